@@ -1,22 +1,50 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import actions as admin_actions
 from lunchclub.models import (
     Person, Attendance, Expense, AccessToken,
-    ShoppingListItem, Announce, Rsvp,
+    ShoppingListItem, Announce, Rsvp, ClosedMonth, get_open_from,
 )
 
 
+class OpenMonthAdmin(admin.ModelAdmin):
+    '''
+    Admin of a model with a date that can't be deleted in closed months.
+    Changes are checked by the model's clean().
+    '''
+    actions = ['delete_selected']
+
+    def has_delete_permission(self, request, obj=None):
+        if obj is not None:
+            open_from = get_open_from()
+            if open_from is not None and obj.date < open_from:
+                return False
+        return super().has_delete_permission(request, obj)
+
+    def delete_selected(self, request, queryset):
+        # The default action doesn't call has_delete_permission(obj).
+        open_from = get_open_from()
+        if open_from is not None and queryset.filter(
+                date__lt=open_from).exists():
+            self.message_user(request, 'Some of the selected objects are ' +
+                              'in closed months', messages.ERROR)
+            return
+        return admin_actions.delete_selected(self, request, queryset)
+    delete_selected.short_description = \
+        admin_actions.delete_selected.short_description
+
+
 @admin.register(Person)
 class PersonAdmin(admin.ModelAdmin):
     list_display = ('username', 'balance', 'user', 'created_time')
 
 
 @admin.register(Attendance)
-class AttendanceAdmin(admin.ModelAdmin):
+class AttendanceAdmin(OpenMonthAdmin):
     list_display = ('person', 'date', 'created_by', 'created_time')
 
 
 @admin.register(Expense)
-class ExpenseAdmin(admin.ModelAdmin):
+class ExpenseAdmin(OpenMonthAdmin):
     list_display = ('person', 'amount', 'date', 'created_by', 'created_time')
 
 
@@ -39,3 +67,9 @@ class AnnounceAdmin(admin.ModelAdmin):
 @admin.register(Rsvp)
 class RsvpAdmin(admin.ModelAdmin):
     list_display = ('status', 'person', 'date')
+
+
+@admin.register(ClosedMonth)
+class ClosedMonthAdmin(admin.ModelAdmin):
+    list_display = ('month', 'expense_sum', 'meals',
+                    'closed_by', 'closed_time')
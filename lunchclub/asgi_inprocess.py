@@ -0,0 +1,25 @@
+"""
+ASGI application serving both the site and the event streams in one
+process, without a channel layer. Run it with an ASGI 3 server, e.g.:
+
+    uvicorn lunchclub.asgi_inprocess:application
+
+Events are only delivered to streams in the same process,
+so run a single process (with a thread pool for the Django views).
+
+This is experimental: the deployment in systemd/ still uses gunicorn and
+Daphne, and uvicorn is not in requirements.txt, so install it separately
+to try this application (e.g. with the ssebench command).
+"""
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lunchclub.settings")
+
+wsgi_application = get_wsgi_application()
+
+# Import after django.setup() in get_wsgi_application()
+from lunchclub.eventstream import EventStreamApp  # noqa
+
+application = EventStreamApp(wsgi_application)
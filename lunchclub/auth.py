@@ -1,15 +1,49 @@
-from django.db.models import F
+import time
+import threading
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from lunchclub.models import AccessToken
+from lunchclub.models import AccessToken, ACCESS_TOKEN_VERSION
+from lunchclub.version import get_version
 
 
 class TokenBackend(object):
+    # Maps token digest to (expiry, version, user_id) for all instances in
+    # this process, so repeated logins with the same token (e.g. from
+    # CalendarUpdate) don't look up the token every time. An entry is only
+    # used while ACCESS_TOKEN_VERSION is unchanged, which is bumped when a
+    # token is deleted or a user is changed in any process.
+    _cache = {}
+    _cache_lock = threading.Lock()
+    cache_size = 1000
+
     def authenticate(self, token=None):
+        if not token:
+            return None
+        digest = AccessToken.make_digest(token)
+        now = time.monotonic()
+        # Get the version before the token, so a revoke in between
+        # is noticed next time.
+        version = get_version(ACCESS_TOKEN_VERSION)
+        with self._cache_lock:
+            expiry, cached_version, user_id = self._cache.get(
+                digest, (0, None, None))
+        if now < expiry and cached_version == version:
+            user = self.get_user(user_id)
+            if user is not None:
+                return user
+        qs = AccessToken.objects.select_related('person__user')
         try:
-            token = AccessToken.objects.get(token=token)
+            token = qs.get(digest=digest)
         except AccessToken.DoesNotExist:
             return None
-        return token.person.get_or_create_user()
+        user = token.person.get_or_create_user()
+        with self._cache_lock:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[digest] = (now + settings.ACCESS_TOKEN_CACHE_TTL,
+                                   version, user.pk)
+        return user
 
     def get_user(self, user_id):
         try:
@@ -0,0 +1,160 @@
+'''
+Helpers for the benchmark management commands.
+'''
+import re
+import time
+import asyncio
+import resource
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import (
+    SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY,
+)
+
+
+def percentile(values, p):
+    '''
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    '''
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+    return values[k]
+
+
+def format_ms(values):
+    return 'p50 %.2f ms, p99 %.2f ms, max %.2f ms' % (
+        1e3 * percentile(values, 50), 1e3 * percentile(values, 99),
+        1e3 * max(values))
+
+
+def get_event_ids(content):
+    '''
+    Return the ids of the events in a chunk of an event stream,
+    without the date of today's events (see lunchclub.today.get_event_id).
+
+    >>> get_event_ids(b'id:12\\nevent:chat\\ndata:{}\\n\\nevent:ping\\ndata:\\n\\n')
+    [12]
+    >>> get_event_ids(b'id:2026-10-19/12\\nevent:rsvps\\ndata:{}\\n\\n')
+    [12]
+    '''
+    return [int(id) for id in
+            re.findall(rb'^id:(?:[\d-]+/)?(\d+)$', content, re.M)]
+
+
+def max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss_bytes():
+    with open('/proc/self/statm') as fp:
+        return int(fp.read().split()[1]) * resource.getpagesize()
+
+
+def make_session_cookie(user):
+    '''
+    Return a Cookie header value for a new session logged in as user.
+    '''
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return '%s=%s' % (settings.SESSION_COOKIE_NAME, session.session_key)
+
+
+class FakeStream:
+    '''
+    Simulated client of an event stream served by an ASGI application.
+    Records the time each chunk of the response body is received.
+    '''
+    def __init__(self, path, cookie, last_event_id=None):
+        headers = [(b'cookie', cookie.encode())]
+        if last_event_id is not None:
+            headers.append((b'last-event-id', str(last_event_id).encode()))
+        self.scope = {'type': 'http', 'method': 'GET', 'path': path,
+                      'query_string': b'', 'headers': headers}
+        self.request_sent = False
+        self.chunks = []
+        self.status = None
+        self.connected = asyncio.Event()
+        self.closed = asyncio.Event()
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {'type': 'http.request', 'body': b''}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        elif message.get('body'):
+            self.chunks.append((time.perf_counter(), message['body']))
+            self.connected.set()
+
+    def run(self, app):
+        return asyncio.ensure_future(
+            app(self.scope, self.receive, self.send))
+
+    def close(self):
+        self.closed.set()
+
+
+class LayerClient:
+    '''
+    Simulated Daphne process with n connections to an event stream,
+    which sends the requests to a channel layer and records the time
+    each response chunk sent to a reply channel is received.
+    '''
+    # Daphne polls the channel layer this often when there is nothing to read.
+    poll_interval = 0.05
+
+    def __init__(self, layer, path, cookie, n,
+                 prefix='daphne.response.bench!'):
+        self.layer = layer
+        self.path = path
+        self.cookie = cookie
+        self.prefix = prefix
+        self.reply_channels = ['%s%s' % (prefix, i) for i in range(n)]
+        self.chunks = {c: [] for c in self.reply_channels}
+        self.running = True
+
+    def connect(self):
+        for reply_channel in self.reply_channels:
+            message = {
+                'reply_channel': reply_channel,
+                'http_version': '1.1',
+                'method': 'GET',
+                'path': self.path,
+                'root_path': '',
+                'scheme': 'http',
+                'query_string': b'',
+                'headers': [(b'cookie', self.cookie.encode())],
+                'body': b'',
+                'client': ['127.0.0.1', 0],
+                'server': ['127.0.0.1', 80],
+            }
+            while True:
+                try:
+                    self.layer.send('http.request', message)
+                    break
+                except self.layer.ChannelFull:
+                    time.sleep(0.001)
+
+    def read(self):
+        while self.running:
+            channel, message = self.layer.receive([self.prefix])
+            if channel is None:
+                time.sleep(self.poll_interval)
+            elif message.get('content'):
+                self.chunks[channel].append(
+                    (time.perf_counter(), message['content']))
@@ -0,0 +1,240 @@
+'''
+Channel layer for several processes on one host, without Redis.
+
+Messages and group memberships are kept in an SQLite database file,
+by default in /dev/shm so that it lives in shared memory. Daphne,
+the workers and the views on the same machine open the same file:
+
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "lunchclub.channel_layer.SQLiteChannelLayer",
+            "CONFIG": {"path": "/dev/shm/lunchclub-channels.sqlite3"},
+            "ROUTING": "lunchclub.routing.channel_routing",
+        },
+    }
+
+Messages are pickled, so the file is created readable by its owner only,
+and all processes must run as the same user.
+'''
+import os
+import time
+import pickle
+import random
+import string
+import sqlite3
+import tempfile
+import threading
+
+from asgiref.base_layer import BaseChannelLayer
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    target TEXT NOT NULL,
+    expiry REAL NOT NULL,
+    content BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel, id);
+CREATE INDEX IF NOT EXISTS messages_expiry ON messages (expiry);
+CREATE TABLE IF NOT EXISTS groups (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expiry REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+);
+'''
+
+
+def default_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'lunchclub-channels-%s.sqlite3' % os.getuid())
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    '''
+    ASGI channel layer storing messages in an SQLite file shared by
+    processes on the same host. Supports the "groups" and "flush" extensions.
+
+    receive(block=True) polls every poll_interval seconds for at most
+    block_timeout seconds. Channels with an expired message are removed
+    from their groups, like in asgiref.inmemory.ChannelLayer.
+    '''
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=None, expiry=60, group_expiry=86400,
+                 capacity=100, channel_capacity=None,
+                 poll_interval=0.01, block_timeout=5, clean_interval=1):
+        super().__init__(expiry=expiry, group_expiry=group_expiry,
+                         capacity=capacity,
+                         channel_capacity=channel_capacity)
+        self.path = path or default_path()
+        self.poll_interval = poll_interval
+        self.block_timeout = block_timeout
+        self.clean_interval = clean_interval
+        self.next_clean = 0
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # One connection per thread, and a new one after fork().
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = self.connect()
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def connect(self):
+        # Create the file with restrictive permissions before SQLite does.
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        connection = sqlite3.connect(self.path, timeout=30,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.executescript(SCHEMA)
+        return connection
+
+    def transaction(self):
+        '''
+        Return a context manager for a write transaction, which
+        serializes the processes receiving from the same channels.
+        '''
+        return Transaction(self.connection)
+
+    ### ASGI API ###
+
+    def send(self, channel, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        with self.transaction() as cursor:
+            self._send(cursor, channel, pickle.dumps(message))
+
+    def _send(self, cursor, target, content):
+        channel = self.non_local_name(target)
+        capacity = self.get_capacity(channel)
+        cursor.execute(
+            'SELECT COUNT(*) FROM (SELECT 1 FROM messages ' +
+            'WHERE channel = ? LIMIT ?)', (channel, capacity))
+        if cursor.fetchone()[0] >= capacity:
+            raise self.ChannelFull(channel)
+        cursor.execute(
+            'INSERT INTO messages (channel, target, expiry, content) ' +
+            'VALUES (?, ?, ?, ?)',
+            (channel, target, time.time() + self.expiry, content))
+
+    def receive(self, channels, block=False):
+        channels = list(channels)
+        assert self.valid_channel_names(channels, receive=True)
+        channels = list(set(self.non_local_name(c) for c in channels))
+        deadline = time.time() + self.block_timeout
+        while True:
+            self._clean_expired()
+            result = self._receive(channels)
+            if result is not None or not block or time.time() > deadline:
+                return result or (None, None)
+            time.sleep(self.poll_interval)
+
+    def _receive(self, channels):
+        query = (
+            'SELECT id, target, content FROM messages ' +
+            'WHERE channel IN (%s) AND expiry >= ? ' % ','.join('?' * len(channels)) +
+            'ORDER BY id LIMIT 1')
+        with self.transaction() as cursor:
+            cursor.execute(query, channels + [time.time()])
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            id, target, content = row
+            cursor.execute('DELETE FROM messages WHERE id = ?', (id,))
+        return target, pickle.loads(content)
+
+    def new_channel(self, pattern):
+        assert isinstance(pattern, str)
+        assert pattern.endswith("?"), "New channel pattern must end with ?"
+        while True:
+            name = pattern + ''.join(
+                random.choice(string.ascii_letters) for i in range(12))
+            cursor = self.connection.execute(
+                'SELECT 1 FROM messages WHERE channel = ? LIMIT 1', (name,))
+            if cursor.fetchone() is None:
+                return name
+
+    ### ASGI Group API ###
+
+    def group_add(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        with self.transaction() as cursor:
+            cursor.execute(
+                'INSERT OR REPLACE INTO groups (group_name, channel, expiry) ' +
+                'VALUES (?, ?, ?)',
+                (group, channel, time.time() + self.group_expiry))
+
+    def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        with self.transaction() as cursor:
+            cursor.execute(
+                'DELETE FROM groups WHERE group_name = ? AND channel = ?',
+                (group, channel))
+
+    def group_channels(self, group):
+        cursor = self.connection.execute(
+            'SELECT channel FROM groups WHERE group_name = ? AND expiry >= ?',
+            (group, time.time()))
+        return [channel for channel, in cursor]
+
+    def send_group(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        self._clean_expired()
+        content = pickle.dumps(message)
+        with self.transaction() as cursor:
+            cursor.execute(
+                'SELECT channel FROM groups ' +
+                'WHERE group_name = ? AND expiry >= ?',
+                (group, time.time()))
+            for channel, in cursor.fetchall():
+                try:
+                    self._send(cursor, channel, content)
+                except self.ChannelFull:
+                    pass
+
+    ### ASGI Flush API ###
+
+    def flush(self):
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM messages')
+            cursor.execute('DELETE FROM groups')
+
+    ### Expire cleanup ###
+
+    def _clean_expired(self):
+        now = time.time()
+        if now < self.next_clean:
+            return
+        self.next_clean = now + self.clean_interval
+        with self.transaction() as cursor:
+            cursor.execute(
+                'DELETE FROM groups WHERE expiry < ? OR channel IN ' +
+                '(SELECT target FROM messages WHERE expiry < ?)',
+                (now, now))
+            cursor.execute('DELETE FROM messages WHERE expiry < ?', (now,))
+
+
+class Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('BEGIN IMMEDIATE')
+        return self.cursor
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.cursor.execute('COMMIT')
+        else:
+            self.cursor.execute('ROLLBACK')
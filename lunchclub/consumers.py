@@ -1,9 +1,23 @@
+import json
+import urllib.parse
+
 # from django.http import HttpResponse
 from channels import Group
+from django.utils import timezone
 # from channels.handler import AsgiRequest, AsgiHandler
-from channels.auth import http_session_user
-from lunchclub.sse import send_status, send_event
-from lunchclub.today import send_current_rsvp
+from channels.auth import (
+    http_session_user, channel_session_user, channel_session_user_from_http,
+)
+from lunchclub.models import Person
+from lunchclub.sse import (
+    send_status, send_event, send_content, get_last_event_id,
+    get_missed_events,
+)
+from lunchclub.today import (
+    send_current_rsvp, get_missed_today_events, get_current_rsvp_frame,
+    format_frame, apply_update, WS_GROUP, VERSION, send_state, wait_for_state,
+)
+from lunchclub.version import get_version
 
 
 @http_session_user
@@ -12,6 +26,9 @@ def chat_stream(message):
     send_status(message.reply_channel, 200)
     send_event(message.reply_channel, 'chat_message',
                'Hello, %s!' % message.user)
+    missed = get_missed_events(group_name, get_last_event_id(message))
+    for content in missed or []:
+        send_content(message.reply_channel, content)
     Group(group_name).add(message.reply_channel)
 
 
@@ -23,7 +40,90 @@ def today_events(message):
         return
 
     send_status(message.reply_channel, 200)
-    send_current_rsvp(message.reply_channel)
+    # When reconnecting, only send what the client missed, if we know it.
+    missed = get_missed_today_events(get_last_event_id(message))
+    if missed is None:
+        send_current_rsvp(message.reply_channel)
+    else:
+        for content in missed:
+            send_content(message.reply_channel, content)
 
     Group('today_events').add(message.reply_channel)
     Group('today_events_%s' % message.user.username).add(message.reply_channel)
+
+
+@http_session_user
+def today_state(message):
+    '''
+    Like lunchclub.views.today_state, but with ?wait=T, wait up to T
+    seconds for a change before answering 304, which Daphne can do
+    without holding a worker.
+    '''
+    if not message.user.is_authenticated():
+        message.reply_channel.send({'status': 400,
+                                    'content': b'Not authenticated'})
+        return
+    query_string = message.content.get('query_string', b'')
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('latin1')
+    params = dict(urllib.parse.parse_qsl(query_string))
+    try:
+        wait = float(params.get('wait') or 0)
+    except ValueError:
+        message.reply_channel.send({'status': 400,
+                                    'content': b'Invalid "wait"'})
+        return
+    # Wait in the group before reading the version, so a change
+    # in between answers the request rather than being missed.
+    group = wait_for_state(message.reply_channel, wait) if wait > 0 else None
+    if (params.get('date') == timezone.now().date().isoformat() and
+            params.get('version') == str(get_version(VERSION))):
+        if group is None:
+            send_state(message.reply_channel, 304)
+        return
+    if group is not None:
+        group.discard(message.reply_channel)
+    send_state(message.reply_channel, 200)
+
+
+@channel_session_user_from_http
+def today_ws_connect(message):
+    if not message.user.is_authenticated():
+        message.reply_channel.send({'close': True})
+        return
+    message.reply_channel.send({'accept': True})
+    message.reply_channel.send({'text': get_current_rsvp_frame()})
+    Group(WS_GROUP).add(message.reply_channel)
+
+
+@channel_session_user
+def today_ws_receive(message):
+    '''
+    Apply a command [kind, key, id] like a POST to today_update,
+    and reply with ["ack", {"id": id}] or ["error", {"id": id, "error": ...}].
+    The change itself arrives as an event like on /today/events/.
+    '''
+    try:
+        kind, key, id = json.loads(message.content['text'])
+    except (KeyError, TypeError, ValueError):
+        reply = format_frame('error', {'id': None, 'error': 'Bad command'})
+        message.reply_channel.send({'text': reply})
+        return
+    if not message.user.is_authenticated():
+        reply = format_frame('error', {'id': id, 'error': 'Not authenticated'})
+        message.reply_channel.send({'text': reply})
+        return
+    person = (Person.for_user(message.user) or
+              Person.get_or_create(message.user.username))
+    try:
+        apply_update(person, kind, key)
+    except ValueError as exn:
+        reply = format_frame('error', {'id': id, 'error': str(exn)})
+    else:
+        reply = format_frame('ack', {'id': id})
+    message.reply_channel.send({'text': reply})
+
+
+@channel_session_user
+def today_ws_disconnect(message):
+    Group(WS_GROUP).discard(message.reply_channel)
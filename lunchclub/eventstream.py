@@ -0,0 +1,292 @@
+'''
+ASGI application serving the event streams in-process with asyncio.
+
+Each open /today/events/ or /chat/stream/ connection is a coroutine
+waiting on a Subscriber queue of a Hub, instead of a reply channel
+in the channel layer, so one process can hold thousands of idle streams.
+All other requests are passed on to the Django WSGI application in a
+thread pool, so that views publishing events run in the same process.
+
+See lunchclub.asgi_inprocess for the application to give to the server.
+'''
+import io
+import sys
+import json
+import asyncio
+import logging
+import concurrent.futures
+from importlib import import_module
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest, parse_cookie
+from django.contrib.auth import get_user
+
+from lunchclub import pubsub
+from lunchclub.sse import format_event, get_missed_events
+import lunchclub.today
+
+
+logger = logging.getLogger('lunchclub')
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def get_header(scope, name):
+    for k, v in scope.get('headers', []):
+        if k.lower() == name:
+            return v.decode('latin1')
+
+
+def get_scope_user(scope):
+    '''
+    Return the User of the session cookie in the ASGI scope.
+    '''
+    cookies = parse_cookie(get_header(scope, b'cookie') or '')
+    engine = import_module(settings.SESSION_ENGINE)
+    request = HttpRequest()
+    request.session = engine.SessionStore(
+        cookies.get(settings.SESSION_COOKIE_NAME))
+    return get_user(request)
+
+
+def make_environ(scope, body):
+    '''
+    Return the WSGI environ for an ASGI HTTP scope and request body.
+    '''
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = 'HTTP_' + name
+        if key in environ:
+            value = environ[key] + ',' + value
+        environ[key] = value
+    return environ
+
+
+class EventStreamApp:
+    '''
+    ASGI 3 application for the event streams, which passes other HTTP
+    requests on to wsgi_application (if given).
+    '''
+    def __init__(self, wsgi_application=None, hub=None, threads=None):
+        self.wsgi_application = wsgi_application
+        self.hub = hub or pubsub.Hub()
+        pubsub.use_hub(self.hub)
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.keepalive_task = None
+        prefix = settings.CHANNEL_SUBPATH
+        self.routes = {
+            prefix + '/today/events/': self.today_events,
+            prefix + '/chat/stream/': self.chat_stream,
+            prefix + '/events/stats/': self.stats,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'websocket':
+            # Reject, so the today widget falls back to /today/events/.
+            return await send({'type': 'websocket.close'})
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported scope type %r' % scope['type'])
+        handler = self.routes.get(scope['path'], self.wsgi)
+        return await handler(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start_keepalive()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def start_keepalive(self):
+        # Not every server supports lifespan, so this is also called
+        # when a stream connects.
+        if self.keepalive_task is None:
+            self.keepalive_task = asyncio.get_event_loop().create_task(
+                self.keepalive())
+
+    async def keepalive(self):
+        content = format_event('ping', '')
+        while True:
+            await asyncio.sleep(settings.EVENT_STREAM_PING_INTERVAL)
+            self.hub.publish(lunchclub.today.GROUP, content)
+            self.hub.publish('chat_stream', content)
+
+    async def run_sync(self, function, *args):
+        '''
+        Run a function that may use the database in the thread pool.
+        '''
+        def run():
+            close_old_connections()
+            try:
+                return function(*args)
+            finally:
+                close_old_connections()
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, run)
+
+    async def read_body(self, receive):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(body)
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def respond(self, send, status, body, content_type):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type)]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def wsgi(self, scope, receive, send):
+        if self.wsgi_application is None:
+            return await self.respond(send, 404, b'Not found', b'text/plain')
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        environ = make_environ(scope, body)
+
+        def run():
+            response = []
+
+            def start_response(status, headers, exc_info=None):
+                response[:] = [status, headers]
+
+            result = self.wsgi_application(environ, start_response)
+            try:
+                chunks = list(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            return response[0], response[1], b''.join(chunks)
+
+        loop = asyncio.get_event_loop()
+        status, headers, body = await loop.run_in_executor(self.executor, run)
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split()[0]),
+            'headers': [(k.lower().encode('latin1'), v.encode('latin1'))
+                        for k, v in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def stats(self, scope, receive, send):
+        # The group names include the usernames of connected users.
+        user = await self.run_sync(get_scope_user, scope)
+        if not user.is_superuser:
+            return await self.respond(send, 403, b'Not superuser',
+                                      b'text/plain')
+        counts = self.hub.subscriber_count()
+        data = {'groups': counts,
+                'subscribers': sum(counts.values())}
+        await self.respond(send, 200, json.dumps(data).encode(),
+                           b'application/json')
+
+    async def stream(self, scope, receive, send, group_names, first):
+        '''
+        Subscribe to the groups, send the contents returned by first(),
+        and then send events published to the groups until the client
+        disconnects.
+        '''
+        self.start_keepalive()
+        subscriber = pubsub.Subscriber(
+            asyncio.get_event_loop(), settings.EVENT_STREAM_QUEUE_SIZE)
+        # Subscribe before calling first(), so no event is missed.
+        for group_name in group_names:
+            self.hub.subscribe(group_name, subscriber)
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        disconnect.add_done_callback(lambda f: subscriber.close())
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': SSE_HEADERS})
+            for content in await self.run_sync(first):
+                await send({'type': 'http.response.body', 'body': content,
+                            'more_body': True})
+            while True:
+                content = await subscriber.queue.get()
+                if content is None:
+                    break
+                await send({'type': 'http.response.body', 'body': content,
+                            'more_body': True})
+            if not disconnect.done():
+                # Subscriber overflowed
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnect.cancel()
+            for group_name in group_names:
+                self.hub.unsubscribe(group_name, subscriber)
+
+    async def today_events(self, scope, receive, send):
+        user = await self.run_sync(get_scope_user, scope)
+        if not user.is_authenticated():
+            await send({'type': 'http.response.start', 'status': 400,
+                        'headers': SSE_HEADERS})
+            await send({'type': 'http.response.body',
+                        'body': format_event('error', 'Not authenticated')})
+            return
+        last_event_id = get_header(scope, b'last-event-id')
+
+        def first():
+            # When reconnecting, only send what the client missed,
+            # if we know it.
+            missed = lunchclub.today.get_missed_today_events(last_event_id)
+            if missed is None:
+                return [lunchclub.today.get_current_rsvp_content()]
+            return missed
+
+        group_names = [lunchclub.today.GROUP,
+                       'today_events_%s' % user.username]
+        await self.stream(scope, receive, send, group_names, first)
+
+    async def chat_stream(self, scope, receive, send):
+        group_name = 'chat_stream'
+        user = await self.run_sync(get_scope_user, scope)
+        last_event_id = get_header(scope, b'last-event-id')
+
+        def first():
+            hello = format_event('chat_message', 'Hello, %s!' % user)
+            missed = get_missed_events(group_name, last_event_id)
+            return [hello] + (missed or [])
+
+        await self.stream(scope, receive, send, [group_name], first)
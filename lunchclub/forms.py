@@ -5,11 +5,14 @@ import datetime
 import collections
 
 from django import forms
+from django.db import transaction
+from django.db.models import Q
 from django.contrib.auth.models import User
 
 from lunchclub.models import (
-    recompute_balances, AccessToken, Expense, Attendance,
-    Person, ShoppingListItem,
+    recompute_balances, update_by_pk, AccessToken, Expense, Attendance,
+    Person, ShoppingListItem, check_open, close_months, reopen_months,
+    data_changed, access_tokens_changed,
 )
 from lunchclub.parser import (
     parse_attenddb, parse_expensedb,
@@ -74,6 +77,12 @@ class DatabaseBulkEditForm(forms.Form):
         if 'expense' in self.cleaned_data:
             self.cleaned_data['diff_expense'] = diff_expense(
                 get_expensedb_from_model(), self.cleaned_data['expense'])
+        # Dates of created objects are checked in dbdiff().
+        removed = [datetime.date(o.year, o.month, o.day)
+                   for field in ('diff_attendance', 'diff_expense')
+                   if field in self.cleaned_data
+                   for o in self.cleaned_data[field][1]]
+        check_open(removed)
 
     def iter_created_removed(self):
         '''
@@ -120,6 +129,24 @@ class SearchForm(forms.Form):
         return m
 
 
+class AccessTokenFilterForm(forms.Form):
+    '''
+    Filter form used in AccessTokenList view to search and paginate persons.
+    '''
+    q = forms.CharField(required=False, widget=forms.TextInput(
+        {'placeholder': 'Search'}))
+    page = forms.IntegerField(min_value=1, required=False,
+                              widget=forms.HiddenInput)
+
+    def filter(self, qs):
+        q = self.cleaned_data.get('q')
+        if q:
+            qs = qs.filter(Q(username__icontains=q) |
+                           Q(display_name__icontains=q) |
+                           Q(user__email__icontains=q))
+        return qs
+
+
 class AccessTokenListForm(forms.Form):
     ChangesBase = collections.namedtuple(
         'Changes',
@@ -147,23 +174,57 @@ class AccessTokenListForm(forms.Form):
                 yield ('%s %s', 'Hide' if b else 'Unhide', person.username)
 
         def save(self):
-            for person in self.save_person:
-                person.save()
-            for person, name in self.set_name:
-                person.display_name = name
-                person.save()
-            for person, email in self.set_email:
-                user = person.get_or_create_user()
-                user.email = email
-                user.save()
-            for token in self.revoke_tokens:
-                token.delete()
-            for token in self.save_tokens:
-                token.person = token.person  # Update token_id
-                token.save()
-            for person, b in self.set_hidden:
-                person.hidden = b
-                person.save()
+            with transaction.atomic():
+                # Only the "new person" row creates a Person,
+                # so there is at most one object in save_person.
+                for person in self.save_person:
+                    person.save()
+                update_by_pk(Person, 'display_name',
+                             {person.pk: name
+                              for person, name in self.set_name})
+                self.save_users()
+                update_by_pk(User, 'email',
+                             {person.user_id: email
+                              for person, email in self.set_email})
+                # Sends post_delete, so TokenBackend forgets the tokens.
+                AccessToken.objects.filter(
+                    pk__in=[token.pk for token in self.revoke_tokens]
+                ).delete()
+                for token in self.save_tokens:
+                    token.person = token.person  # Update person_id
+                AccessToken.objects.bulk_create(self.save_tokens)
+                for person, b in self.set_hidden:
+                    person.hidden = b
+                update_by_pk(Person, 'hide_after',
+                             {person.pk: person.hide_after
+                              for person, b in self.set_hidden})
+                Person.uncache(
+                    [person for person, name in self.set_name] +
+                    [person for person, b in self.set_hidden])
+                if self.set_name or self.set_hidden:
+                    # update() sends no post_save, so bump the version
+                    # of the balance table, which shows names and hidden.
+                    data_changed()
+
+        def save_users(self):
+            '''
+            Create a User for each Person in set_email that doesn't have one.
+            '''
+            persons = [person for person, email in self.set_email
+                       if person.user_id is None]
+            if not persons:
+                return
+            usernames = [person.username for person in persons]
+            User.objects.bulk_create(
+                [User(username=username) for username in usernames])
+            # bulk_create() doesn't set pk on all backends, so fetch users.
+            users = {u.username: u
+                     for u in User.objects.filter(username__in=usernames)}
+            for person in persons:
+                person.user = users[person.username]
+            update_by_pk(Person, 'user',
+                         {person.pk: person.user_id for person in persons})
+            access_tokens_changed()
 
     def __init__(self, **kwargs):
         queryset = kwargs.pop('queryset')
@@ -172,9 +233,12 @@ class AccessTokenListForm(forms.Form):
         self.persons = []
         self.rows = []
 
-        self.tokens = AccessToken.all_as_dict()
+        # The queryset must come from AccessToken.annotate_latest().
+        persons = list(queryset)
+        self.tokens = {person.username: AccessToken.from_annotation(person)
+                       for person in persons}
 
-        for person in list(queryset.select_related()) + [Person()]:
+        for person in persons + [Person()]:
             base = 'p_%s_' % person.username
             # The last person is a "new person" for which base == 'p__'.
             user = person.user or User()
@@ -428,6 +492,45 @@ class MonthForm(forms.Form):
         return y, m
 
 
+class CloseMonthsForm(forms.Form):
+    '''
+    Form used in CloseMonths view to close the months up to a month,
+    or to reopen the months from a month.
+    '''
+    def __init__(self, **kwargs):
+        close_choices = kwargs.pop('close_choices')
+        reopen_choices = kwargs.pop('reopen_choices')
+        super().__init__(**kwargs)
+        self.fields['close'] = forms.TypedChoiceField(
+            label='Close months up to and including',
+            choices=self.month_choices(close_choices),
+            coerce=self.parse_month, empty_value=None, required=False)
+        self.fields['reopen'] = forms.TypedChoiceField(
+            label='Reopen months from',
+            choices=self.month_choices(reopen_choices),
+            coerce=self.parse_month, empty_value=None, required=False)
+
+    def month_choices(self, months):
+        return [('', '---------')] + [
+            (d.strftime('%Y-%m-%d'), d.strftime('%B %Y')) for d in months]
+
+    def parse_month(self, s):
+        return datetime.datetime.strptime(s, '%Y-%m-%d').date()
+
+    def clean(self):
+        close = self.cleaned_data.get('close')
+        reopen = self.cleaned_data.get('reopen')
+        if (close is None) == (reopen is None):
+            raise forms.ValidationError(
+                'Choose either a month to close or a month to reopen')
+
+    def save(self, user):
+        if self.cleaned_data['close'] is not None:
+            close_months(self.cleaned_data['close'], user)
+        else:
+            reopen_months(self.cleaned_data['reopen'])
+
+
 class AttendanceCreateForm(forms.Form):
     lines = forms.CharField(widget=forms.Textarea, required=False)
 
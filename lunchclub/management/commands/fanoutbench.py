@@ -0,0 +1,235 @@
+import time
+import asyncio
+import threading
+import tracemalloc
+
+from asgiref.inmemory import ChannelLayer
+from channels import DEFAULT_CHANNEL_LAYER, channel_layers
+from channels.asgi import ChannelLayerWrapper
+from channels.worker import Worker
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from lunchclub.bench import (
+    FakeStream, LayerClient, make_session_cookie, format_ms,
+    current_rss_bytes, get_event_ids,
+)
+from lunchclub.eventstream import EventStreamApp
+from lunchclub.models import Person, Rsvp, Announce
+from lunchclub import pubsub
+import lunchclub.today
+
+
+class Command(BaseCommand):
+    help = ('Open N simulated /today/events/ subscribers in a test ' +
+            'database, make RSVP and announce writes and report how long ' +
+            'the events take to reach every subscriber.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--connections', type=int, default=1000)
+        parser.add_argument('-w', '--writes', type=int, default=20)
+        parser.add_argument(
+            '-t', '--transport', choices=('channels', 'hub'),
+            default='channels',
+            help='channels: the consumers in lunchclub.consumers behind ' +
+            'an in-memory channel layer and a worker thread; ' +
+            'hub: the in-process app in lunchclub.eventstream')
+        parser.add_argument('--capacity', type=int, default=100,
+                            help='Channel capacity of the channel layer. ' +
+                            'All connections of one Daphne share one ' +
+                            'reply channel.')
+        parser.add_argument('--coalesce', type=float,
+                            default=settings.TODAY_COALESCE_WINDOW,
+                            help='TODAY_COALESCE_WINDOW in seconds')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='Seconds to wait for each delivery')
+
+    def handle(self, *args, **options):
+        self.options = options
+        lunchclub.today.rsvp_coalescer.window = options['coalesce']
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            user = User.objects.create(username='bench')
+            self.persons = [
+                Person.objects.create(
+                    user=user if i == 0 else None, username='bench%s' % i,
+                    display_name='Bench %s' % i, balance=0)
+                for i in range(10)
+            ]
+            cookie = make_session_cookie(user)
+            path = settings.CHANNEL_SUBPATH + '/today/events/'
+            if options['transport'] == 'channels':
+                self.run_channels(path, cookie)
+            else:
+                self.run_hub(path, cookie)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def run_channels(self, path, cookie):
+        layer = ChannelLayer(capacity=self.options['capacity'])
+        routing = settings.CHANNEL_LAYERS[DEFAULT_CHANNEL_LAYER]['ROUTING']
+        channel_layers.set(
+            DEFAULT_CHANNEL_LAYER,
+            ChannelLayerWrapper(layer, DEFAULT_CHANNEL_LAYER, routing))
+        worker = Worker(channel_layers[DEFAULT_CHANNEL_LAYER],
+                        signal_handlers=False)
+        client = LayerClient(layer, path, cookie, self.options['connections'])
+        threads = [threading.Thread(target=worker.run),
+                   threading.Thread(target=client.read)]
+        for thread in threads:
+            thread.start()
+
+        def connect():
+            client.connect()
+            return list(client.chunks.values())
+
+        try:
+            streams = self.connect(connect)
+            self.stdout.write('(Memory of the channel layer and worker, ' +
+                              'not of Daphne)')
+            self.write(streams)
+        finally:
+            worker.termed = True
+            client.running = False
+            for thread in threads:
+                thread.join()
+
+    def run_hub(self, path, cookie):
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        app = EventStreamApp()
+        fake_streams = []
+        tasks = []
+
+        def call(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        async def open_streams():
+            # Create the streams in the thread running the event loop.
+            for _ in range(self.options['connections']):
+                stream = FakeStream(path, cookie)
+                fake_streams.append(stream)
+                tasks.append(stream.run(app))
+            return [stream.chunks for stream in fake_streams]
+
+        async def stop_keepalive():
+            if app.keepalive_task is not None:
+                app.keepalive_task.cancel()
+                await asyncio.wait([app.keepalive_task])
+
+        try:
+            streams = self.connect(lambda: call(open_streams()))
+            self.write(streams)
+        finally:
+            for stream in fake_streams:
+                loop.call_soon_threadsafe(stream.close)
+            if tasks:
+                call(asyncio.wait(tasks))
+            call(stop_keepalive())
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            app.executor.shutdown()
+            pubsub.use_hub(None)
+
+    def wait(self, predicate):
+        deadline = time.perf_counter() + self.options['timeout']
+        while not predicate():
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def connect(self, open_streams):
+        '''
+        Call open_streams(), which returns the lists of (time, content)
+        chunks of the subscribers, and wait for every subscriber to
+        receive the current state.
+        '''
+        n = self.options['connections']
+        tracemalloc.start()
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+        streams = open_streams()
+        if not self.wait(lambda: all(streams)):
+            self.stdout.write('Only %s of %s subscribers connected' %
+                              (sum(1 for s in streams if s), n))
+        elapsed = time.perf_counter() - start
+        python_bytes = tracemalloc.get_traced_memory()[0]
+        rss_after = current_rss_bytes()
+        tracemalloc.stop()
+        self.stdout.write('%s subscribers connected in %.2f s' % (n, elapsed))
+        self.stdout.write('Memory per subscriber: %.1f kB Python heap, ' %
+                          (python_bytes / n / 1024) +
+                          '%.1f kB RSS' % ((rss_after - rss_before) / n / 1024))
+        return streams
+
+    def make_write(self, i):
+        person = self.persons[i % len(self.persons)]
+        now = timezone.now()
+        if i % 5 == 4:
+            Announce.create(now, person, Announce.KIND[0][0])
+        else:
+            status = Rsvp.STATUS[i % len(Rsvp.STATUS)][0]
+            Rsvp.set_rsvp(now.date(), person, status)
+
+    def next_event_time(self, chunks, start):
+        # Keepalives have no id, so they are skipped.
+        for t, content in chunks[start:]:
+            if get_event_ids(content):
+                return t
+
+    def write(self, streams):
+        writes = self.options['writes']
+
+        # One write at a time: time from the write to each subscriber.
+        latencies = []
+        missed = 0
+        start = time.perf_counter()
+        for i in range(writes):
+            seen = [len(chunks) for chunks in streams]
+            t = time.perf_counter()
+            self.make_write(i)
+            self.wait(lambda: all(
+                self.next_event_time(chunks, k) is not None
+                for chunks, k in zip(streams, seen)))
+            for chunks, k in zip(streams, seen):
+                received = self.next_event_time(chunks, k)
+                if received is None:
+                    missed += 1
+                else:
+                    latencies.append(received - t)
+        elapsed = time.perf_counter() - start
+        self.stdout.write('%s writes one at a time in %.2f s' %
+                          (writes, elapsed))
+        if latencies:
+            self.stdout.write('Write to delivery: %s' % format_ms(latencies))
+        self.stdout.write('Missed deliveries: %s of %s' %
+                          (missed, writes * len(streams)))
+
+        # All writes at once: time until every subscriber is up to date.
+        seen = [len(chunks) for chunks in streams]
+        start = time.perf_counter()
+        for i in range(writes):
+            self.make_write(i)
+        lunchclub.today.rsvp_coalescer.flush()
+        version = lunchclub.today.get_version(lunchclub.today.VERSION)
+
+        def up_to_date(chunks, k):
+            return any(version in get_event_ids(content)
+                       for t, content in chunks[k:])
+
+        complete = self.wait(lambda: all(
+            up_to_date(chunks, k) for chunks, k in zip(streams, seen)))
+        elapsed = time.perf_counter() - start
+        events = sum(
+            1 for chunks, k in zip(streams, seen)
+            for t, content in chunks[k:] if get_event_ids(content))
+        self.stdout.write(
+            '%s writes at once: %s events delivered in %.2f s ' %
+            (writes, events, elapsed) +
+            '(%.0f events/s)%s' %
+            (events / elapsed, '' if complete else ', some missed'))
@@ -0,0 +1,73 @@
+import time
+import threading
+import collections
+import urllib.error
+import urllib.request
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from lunchclub.bench import make_session_cookie, format_ms
+
+
+class Command(BaseCommand):
+    help = ('Request URLs of running servers and report latency, e.g. ' +
+            'to compare Home served by gunicorn with Home served by ' +
+            'Daphne through the channel layer.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='+')
+        parser.add_argument('-n', '--requests', type=int, default=1000)
+        parser.add_argument('-c', '--concurrency', type=int, default=4)
+        parser.add_argument('-u', '--username',
+                            help='Send a session cookie for this user')
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['username']:
+            user = User.objects.get(username=options['username'])
+            headers['Cookie'] = make_session_cookie(user)
+        for url in options['url']:
+            # Warm up connections, caches and lazy imports.
+            self.run(url, headers, 10, 1)
+            start = time.perf_counter()
+            latencies, statuses = self.run(
+                url, headers, options['requests'], options['concurrency'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(url)
+            self.stdout.write('  %s' % format_ms(latencies))
+            self.stdout.write('  %.1f requests/s, status %s' % (
+                len(latencies) / elapsed,
+                ', '.join('%s: %s' % kv for kv in sorted(statuses.items()))))
+
+    def run(self, url, headers, n, concurrency):
+        latencies = []
+        statuses = collections.Counter()
+        remaining = iter(range(n))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                request = urllib.request.Request(url, headers=headers)
+                t = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(request) as response:
+                        response.read()
+                        status = response.status
+                except urllib.error.HTTPError as exn:
+                    status = exn.code
+                t = time.perf_counter() - t
+                with lock:
+                    latencies.append(t)
+                    statuses[status] += 1
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, statuses
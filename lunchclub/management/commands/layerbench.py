@@ -0,0 +1,98 @@
+import os
+import time
+import tempfile
+import multiprocessing
+
+from asgiref.inmemory import ChannelLayer
+from django.core.management.base import BaseCommand
+
+from lunchclub.channel_layer import SQLiteChannelLayer
+
+
+def drain(layer, channel, n, results):
+    received = 0
+    while received < n:
+        if layer.receive([channel], block=True)[0] is not None:
+            received += 1
+    results.put(received)
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the SQLite channel layer ' +
+            '(lunchclub.channel_layer) with the in-memory layer.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--messages', type=int, default=10000)
+        parser.add_argument('-g', '--group-size', type=int, default=1000)
+        parser.add_argument('-p', '--processes', type=int, default=4)
+
+    def handle(self, *args, **options):
+        n = options['messages']
+        with tempfile.TemporaryDirectory() as directory:
+            layers = [
+                ('in-memory', ChannelLayer(capacity=100)),
+                ('sqlite', SQLiteChannelLayer(
+                    os.path.join(directory, 'layer.sqlite3'),
+                    capacity=100)),
+            ]
+            for name, layer in layers:
+                self.stdout.write(name)
+                self.send_receive(layer, n)
+                self.send_group(layer, options['group_size'])
+            self.processes(layers[1][1], n, options['processes'])
+
+    def report(self, what, count, elapsed):
+        self.stdout.write('  %s: %.0f messages/s' % (what, count / elapsed))
+
+    def send_receive(self, layer, n, batch=100):
+        message = {'body': b'x' * 200}
+        send_time = receive_time = 0
+        for _ in range(n // batch):
+            start = time.perf_counter()
+            for _ in range(batch):
+                layer.send('bench', message)
+            send_time += time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(batch):
+                layer.receive(['bench'])
+            receive_time += time.perf_counter() - start
+        self.report('send', n // batch * batch, send_time)
+        self.report('receive', n // batch * batch, receive_time)
+
+    def send_group(self, layer, size):
+        # Like the today_events group of reply channels in one Daphne.
+        for i in range(size):
+            layer.group_add('bench', 'daphne.response.bench!%s' % i)
+        start = time.perf_counter()
+        layer.send_group('bench', {'content': b'x' * 200})
+        received = 0
+        while layer.receive(['daphne.response.bench!'])[0] is not None:
+            received += 1
+        self.report('send_group + receive (%s members)' % size,
+                    received, time.perf_counter() - start)
+        layer.flush()
+
+    def processes(self, layer, n, processes):
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=drain,
+                args=(layer, 'bench', n // processes, results),
+                daemon=True)
+            for _ in range(processes)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for _ in range(n // processes * processes):
+            while True:
+                try:
+                    layer.send('bench', {'body': b'x' * 200})
+                    break
+                except layer.ChannelFull:
+                    time.sleep(0.001)
+        received = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        self.stdout.write('sqlite, %s receiving processes' % processes)
+        self.report('send + receive', received, time.perf_counter() - start)
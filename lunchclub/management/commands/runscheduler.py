@@ -0,0 +1,28 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from lunchclub.scheduler import get_default_scheduler
+
+
+class Command(BaseCommand):
+    help = ('Run periodic jobs such as event stream keepalives. ' +
+            'Send SIGUSR1 to print timing stats for each job.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats-interval', type=float, default=3600,
+                            help='Seconds between logging job stats')
+
+    def handle(self, *args, **options):
+        scheduler = get_default_scheduler()
+
+        def print_stats(*args):
+            for job in scheduler.jobs:
+                self.stdout.write(str(job))
+            self.stdout.flush()
+
+        signal.signal(signal.SIGUSR1, print_stats)
+        try:
+            scheduler.run_forever(stats_interval=options['stats_interval'])
+        except KeyboardInterrupt:
+            print_stats()
@@ -0,0 +1,73 @@
+import time
+import asyncio
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+
+from lunchclub.bench import (
+    FakeStream, make_session_cookie, format_ms, current_rss_bytes,
+)
+from lunchclub.eventstream import EventStreamApp
+from lunchclub.models import Person
+from lunchclub.sse import format_event
+import lunchclub.today
+
+
+class Command(BaseCommand):
+    help = ('Open many idle /today/events/ streams on the in-process ' +
+            'ASGI application (lunchclub.eventstream) in a test database ' +
+            'and report memory use and broadcast time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--connections', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(self.run(options['connections']))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    async def run(self, n):
+        user = User.objects.create(username='bench')
+        Person.objects.create(user=user, username='bench',
+                              display_name='Bench', balance=0)
+        cookie = make_session_cookie(user)
+        app = EventStreamApp()
+        path = settings.CHANNEL_SUBPATH + '/today/events/'
+
+        tracemalloc.start()
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+        streams = [FakeStream(path, cookie) for _ in range(n)]
+        tasks = [stream.run(app) for stream in streams]
+        await asyncio.wait([asyncio.ensure_future(stream.connected.wait())
+                            for stream in streams])
+        elapsed = time.perf_counter() - start
+        python_bytes, python_peak = tracemalloc.get_traced_memory()
+        rss_after = current_rss_bytes()
+        tracemalloc.stop()
+
+        subscribers = app.hub.subscriber_count()[lunchclub.today.GROUP]
+        self.stdout.write('%s streams connected in %.2f s (%s subscribers)' %
+                          (n, elapsed, subscribers))
+        self.stdout.write('Memory per stream: %.1f kB Python heap, ' %
+                          (python_bytes / n / 1024) +
+                          '%.1f kB RSS' % ((rss_after - rss_before) / n / 1024))
+
+        # Time one broadcast to all idle streams.
+        published = time.perf_counter()
+        app.hub.publish(lunchclub.today.GROUP, format_event('ping', ''))
+        while any(len(stream.chunks) < 2 for stream in streams):
+            await asyncio.sleep(0.05)
+        latencies = [stream.chunks[1][0] - published for stream in streams]
+        self.stdout.write('Broadcast delivery: %s' % format_ms(latencies))
+
+        for stream in streams:
+            stream.close()
+        await asyncio.wait(tasks)
+        app.executor.shutdown()
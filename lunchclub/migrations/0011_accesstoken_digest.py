@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 10:12
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def set_digests(apps, schema_editor):
+    AccessToken = apps.get_model('lunchclub', 'AccessToken')
+    for o in AccessToken.objects.all():
+        o.digest = hashlib.sha256(o.token.encode()).hexdigest()
+        o.save(update_fields=['digest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lunchclub', '0010_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesstoken',
+            name='digest',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_digests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 23:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def compute_totals(apps, schema_editor):
+    Expense = apps.get_model('lunchclub', 'Expense')
+    Attendance = apps.get_model('lunchclub', 'Attendance')
+    MealTotals = apps.get_model('lunchclub', 'MealTotals')
+    expense_sum = Expense.objects.aggregate(s=Sum('amount'))['s'] or 0
+    meals = Attendance.objects.values('date', 'person_id').distinct()
+    MealTotals.objects.create(pk=1, expense_cents=int(expense_sum * 100),
+                              meals=meals.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lunchclub', '0011_accesstoken_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MealTotals',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expense_cents', models.BigIntegerField()),
+                ('meals', models.IntegerField()),
+            ],
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
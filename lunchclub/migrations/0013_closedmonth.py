@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 23:53
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import lunchclub.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('lunchclub', '0012_mealtotals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClosedMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('expense_sum', lunchclub.fields.AmountField(decimal_places=2, max_digits=19)),
+                ('meals', models.IntegerField()),
+                ('closed_time', models.DateTimeField(auto_now_add=True)),
+                ('closed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ClosedMonthBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=12, max_digits=30)),
+                ('closed_month', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lunchclub.ClosedMonth')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lunchclub.Person')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='closedmonthbalance',
+            unique_together=set([('closed_month', 'person')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 00:15
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lunchclub', '0014_version'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Version',
+        ),
+    ]
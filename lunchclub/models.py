@@ -1,18 +1,36 @@
 import re
 import random
 import string
+import hashlib
 import decimal
 import datetime
 import collections
 
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Sum, Q, Max, F
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.db.models import (
+    Sum, Q, Max, F, Case, When, Value, OuterRef, Subquery,
+)
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from lunchclub.fields import AmountField
+from lunchclub.version import bump_version
+
+
+# Version of the persons, expenses and attendances, that is,
+# of everything in the balance table on Home.
+DATA_VERSION = 'data'
+
+
+def data_changed():
+    # Bump after commit, so a request doesn't cache the old data
+    # under the new version.
+    transaction.on_commit(lambda: bump_version(DATA_VERSION))
 
 
 def username_validate(v):
@@ -45,6 +63,37 @@ class Person(models.Model):
             p.save()
             return p
 
+    @classmethod
+    def for_user(cls, user):
+        '''
+        Return the Person of the given User, or None if there is none.
+
+        The result is cached by user id and the cache is invalidated
+        when the Person is saved or deleted, so only use the result
+        to identify the Person (the balance may be out of date).
+        '''
+        key = cls.user_cache_key(user.pk)
+        person = cache.get(key)
+        if person is None:
+            try:
+                person = cls.objects.get(user=user)
+            except cls.DoesNotExist:
+                return None
+            cache.set(key, person, settings.PERSON_CACHE_TIMEOUT)
+        return person
+
+    @staticmethod
+    def user_cache_key(user_id):
+        return 'lunchclub:person_for_user:%s' % user_id
+
+    @classmethod
+    def uncache(cls, persons):
+        '''
+        Invalidate for_user() for persons changed by QuerySet.update().
+        '''
+        cache.delete_many([cls.user_cache_key(p.user_id)
+                           for p in persons if p.user_id is not None])
+
     def get_or_create_user(self):
         if self.user is not None:
             return self.user
@@ -104,6 +153,13 @@ class Person(models.Model):
             self.hide_after = None
 
 
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def person_changed(sender, instance, **kwargs):
+    Person.uncache([instance])
+    data_changed()
+
+
 class Attendance(models.Model):
     date = models.DateField()
     person = models.ForeignKey(Person)
@@ -132,6 +188,9 @@ class Attendance(models.Model):
     def month(self):
         return (self.date.year, self.date.month)
 
+    def clean(self):
+        check_open_change(self)
+
     class Meta:
         ordering = ['date', 'person', 'created_by']
 
@@ -166,6 +225,9 @@ class Expense(models.Model):
     def month(self):
         return (self.date.year, self.date.month)
 
+    def clean(self):
+        check_open_change(self)
+
     class Meta:
         ordering = ['date', 'person', 'amount']
 
@@ -173,9 +235,19 @@ class Expense(models.Model):
 class AccessToken(models.Model):
     person = models.ForeignKey(Person)
     token = models.CharField(max_length=200)
+    # SHA-256 of token, which is what tokens are looked up by.
+    digest = models.CharField(max_length=64, db_index=True, editable=False)
     created_time = models.DateTimeField(auto_now_add=True)
     use_count = models.IntegerField(default=0)
 
+    @staticmethod
+    def make_digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.digest = self.make_digest(self.token)
+        super().save(*args, **kwargs)
+
     @classmethod
     def get_or_create(cls, person):
         qs = AccessToken.objects.filter(person=person)
@@ -194,16 +266,26 @@ class AccessToken(models.Model):
                 '?token=' + self.token)
 
     @classmethod
-    def all_as_dict(self):
-        token_qs = AccessToken.objects.all()
-        token_qs = token_qs.annotate(username=F('person__username'))
-        tokens = {}
-        for t in token_qs:
-            ex = tokens.setdefault(t.username, t)
-            if ex.created_time < t.created_time:
-                # Retain token with latest created_time
-                tokens[t.username] = t
-        return tokens
+    def annotate_latest(cls, person_qs):
+        '''
+        Annotate each Person with the pk, token and use_count of their latest
+        AccessToken, and fetch the Person's User in the same query.
+        Use from_annotation() to get the AccessToken object.
+        '''
+        latest = cls.objects.filter(person=OuterRef('pk'))
+        latest = latest.order_by('-created_time')
+        return person_qs.select_related('user').annotate(
+            latest_token_id=Subquery(latest.values('pk')[:1]),
+            latest_token=Subquery(latest.values('token')[:1]),
+            latest_token_use_count=Subquery(latest.values('use_count')[:1]))
+
+    @classmethod
+    def from_annotation(cls, person):
+        if getattr(person, 'latest_token_id', None) is None:
+            return cls()
+        return cls(pk=person.latest_token_id, person=person,
+                   token=person.latest_token,
+                   use_count=person.latest_token_use_count)
 
     @classmethod
     def fresh(cls, person):
@@ -211,7 +293,45 @@ class AccessToken(models.Model):
         N = cls._meta.get_field('token').max_length
         chars = string.ascii_letters + string.digits
         token = ''.join(rng.choice(chars) for _ in range(N))
-        return cls(person=person, token=token)
+        # Set digest here since bulk_create() doesn't call save().
+        return cls(person=person, token=token, digest=cls.make_digest(token))
+
+
+# Version of the access tokens and of the users they log in as,
+# so that every process forgets revoked tokens (see TokenBackend).
+ACCESS_TOKEN_VERSION = 'access_tokens'
+
+
+def access_tokens_changed():
+    transaction.on_commit(lambda: bump_version(ACCESS_TOKEN_VERSION))
+
+
+@receiver(post_delete, sender=AccessToken)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def access_token_user_changed(sender, **kwargs):
+    # Every login saves last_login, which doesn't matter here.
+    if kwargs.get('update_fields') != frozenset(['last_login']):
+        access_tokens_changed()
+
+
+def update_by_pk(model, field_name, values):
+    '''
+    Set field_name to values[pk] on each object in values using one UPDATE.
+    '''
+    # Set None with a separate UPDATE, since a CASE of only NULLs may be
+    # typed as text on PostgreSQL, which can't be assigned to e.g. a date.
+    none_pks = [pk for pk, v in values.items() if v is None]
+    if none_pks:
+        model.objects.filter(pk__in=none_pks).update(**{field_name: None})
+    values = {pk: v for pk, v in values.items() if v is not None}
+    if not values:
+        return
+    field = model._meta.get_field(field_name)
+    whens = [When(pk=pk, then=Value(v, output_field=field))
+             for pk, v in values.items()]
+    qs = model.objects.filter(pk__in=list(values.keys()))
+    qs.update(**{field_name: Case(*whens, output_field=field)})
 
 
 def compute_meal_prices(expense_qs, attendance_qs):
@@ -246,6 +366,15 @@ def compute_month_balances(expense_qs=None, attendance_qs=None,
     expense_qs = list(expense_qs.values_list('date', 'person_id', 'amount'))
     # Put into set() to remove duplicate (person_id,date)-pairs
     attendance_qs = set(attendance_qs.values_list('date', 'person_id'))
+    return compute_month_balances_from_rows(expense_qs, attendance_qs,
+                                            meal_prices)
+
+
+def compute_month_balances_from_rows(expense_qs, attendance_qs,
+                                     meal_prices=None):
+    '''
+    Internal function used by compute_month_balances() and close_months().
+    '''
     if meal_prices is None:
         meal_prices = compute_meal_prices(expense_qs, attendance_qs)
     balances = collections.defaultdict(
@@ -259,18 +388,99 @@ def compute_month_balances(expense_qs=None, attendance_qs=None,
     return meal_prices, balances
 
 
+def compute_balances_since(earliest_date):
+    '''
+    Like compute_month_balances() for the expenses and attendances
+    from earliest_date (the first day of a month) on, except that
+    closed months are read from their ClosedMonth snapshot.
+    '''
+    open_from = get_open_from()
+    if open_from is None or open_from <= earliest_date:
+        return compute_month_balances(
+            Expense.objects.filter(date__gte=earliest_date),
+            Attendance.objects.filter(date__gte=earliest_date))
+    meal_prices, balances = compute_month_balances(
+        Expense.objects.filter(date__gte=open_from),
+        Attendance.objects.filter(date__gte=open_from))
+    for closed_month in ClosedMonth.objects.filter(month__gte=earliest_date):
+        meal_prices[closed_month.ym] = closed_month.meal_price
+    qs = ClosedMonthBalance.objects.filter(
+        closed_month__month__gte=earliest_date)
+    qs = qs.values_list('person_id', 'closed_month__month', 'balance')
+    for person_id, month, balance in qs:
+        balances[person_id][month.year, month.month] = balance
+    return meal_prices, balances
+
+
 def recompute_balances():
     '''
-    Update every Person's balance attribute.
+    Update every Person's balance attribute and the MealTotals.
 
     Must be called every time expenses/attendances are changed.
+    Only the expenses and attendances of open months are read.
     '''
-    meal_prices, balances = compute_month_balances()
+    open_from = get_open_from()
+    if open_from is None:
+        closed_balances = {}
+        meal_prices, balances = compute_month_balances()
+    else:
+        qs = ClosedMonthBalance.objects.values_list('person_id')
+        closed_balances = dict(qs.annotate(s=Sum('balance')))
+        meal_prices, balances = compute_month_balances(
+            Expense.objects.filter(date__gte=open_from),
+            Attendance.objects.filter(date__gte=open_from))
 
     person_ids = Person.objects.all().values_list('id', flat=True)
     for p_id in person_ids:
-        person_balance = sum(balances[p_id].values())
+        person_balance = (closed_balances.get(p_id, 0) +
+                          sum(balances[p_id].values()))
         Person.objects.filter(id=p_id).update(balance=person_balance)
+    MealTotals.recompute()
+    data_changed()
+
+
+class MealTotals(models.Model):
+    '''
+    The single row (pk=1) with the sum of all expenses in cents and the
+    number of meals, that is, distinct (person, date) attendances,
+    as in compute_meal_prices(). Updated by recompute_balances().
+    '''
+    expense_cents = models.BigIntegerField()
+    meals = models.IntegerField()
+
+    @classmethod
+    def compute(cls):
+        open_from = get_open_from()
+        expense_qs = Expense.objects.all()
+        attendance_qs = Attendance.objects.all()
+        closed = dict(expense_sum=0, meals=0)
+        if open_from is not None:
+            expense_qs = expense_qs.filter(date__gte=open_from)
+            attendance_qs = attendance_qs.filter(date__gte=open_from)
+            closed = ClosedMonth.objects.aggregate(
+                expense_sum=Sum('expense_sum'), meals=Sum('meals'))
+        expense_sum = expense_qs.aggregate(s=Sum('amount'))['s'] or 0
+        expense_sum += closed['expense_sum'] or 0
+        meals = attendance_qs.values('date', 'person_id').distinct().count()
+        meals += closed['meals'] or 0
+        return dict(expense_cents=int(expense_sum * 100), meals=meals)
+
+    @classmethod
+    def recompute(cls):
+        cls.objects.update_or_create(pk=1, defaults=cls.compute())
+
+    @classmethod
+    def get(cls):
+        try:
+            return cls.objects.get(pk=1)
+        except cls.DoesNotExist:
+            return cls.objects.get_or_create(pk=1, defaults=cls.compute())[0]
+
+    @property
+    def average_meal_price(self):
+        if not self.meals:
+            return 0
+        return decimal.Decimal(self.expense_cents) / 100 / self.meals
 
 
 def get_average_meal_price():
@@ -279,11 +489,182 @@ def get_average_meal_price():
 
     Used in the Home view.
     '''
-    expense_qs = Expense.objects.all()
-    attendance_qs = Attendance.objects.all()
-    expense_sum = expense_qs.aggregate(s=Sum('amount'))['s']
-    attendance_count = attendance_qs.count()
-    return expense_sum / attendance_count if attendance_count else 0
+    return MealTotals.get().average_meal_price
+
+
+def first_of_next_month(date):
+    '''
+    >>> first_of_next_month(datetime.date(2017, 12, 24))
+    datetime.date(2018, 1, 1)
+    '''
+    y, m = divmod(date.year * 12 + date.month, 12)
+    return datetime.date(y, m + 1, 1)
+
+
+class ClosedMonth(models.Model):
+    '''
+    A month whose expenses and attendances can no longer be changed,
+    with its sum of expenses and number of meals.
+
+    Every month up to the latest ClosedMonth is closed, and there is a
+    ClosedMonth for each of them from the first month with any data.
+    '''
+    month = models.DateField(unique=True)  # The first day of the month
+    expense_sum = AmountField()
+    meals = models.IntegerField()
+    closed_by = models.ForeignKey(User, on_delete=models.SET_NULL,
+                                  null=True, blank=True)
+    closed_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['month']
+
+    def __str__(self):
+        return self.month.strftime('%Y-%m')
+
+    @property
+    def ym(self):
+        return (self.month.year, self.month.month)
+
+    @property
+    def meal_price(self):
+        # Like compute_meal_prices()
+        if not self.meals:
+            return float('inf') if self.expense_sum else 0
+        return self.expense_sum / decimal.Decimal(self.meals)
+
+
+class ClosedMonthBalance(models.Model):
+    '''
+    A Person's balance change in a ClosedMonth.
+    '''
+    closed_month = models.ForeignKey(ClosedMonth, on_delete=models.CASCADE)
+    person = models.ForeignKey(Person, on_delete=models.CASCADE)
+    # Not rounded to cents, so the sum over the months is the balance
+    # computed from the expenses and attendances.
+    balance = models.DecimalField(max_digits=30, decimal_places=12)
+
+    class Meta:
+        unique_together = ('closed_month', 'person')
+
+
+def get_open_from():
+    '''
+    Return the first day of the first open month,
+    or None if no month is closed.
+    '''
+    month = ClosedMonth.objects.aggregate(m=Max('month'))['m']
+    return None if month is None else first_of_next_month(month)
+
+
+def check_open(dates, open_from=None):
+    '''
+    Raise ValidationError if any of the dates is in a closed month.
+    '''
+    if open_from is None:
+        open_from = get_open_from()
+    if open_from is None:
+        return
+    closed = sorted(d for d in dates if d < open_from)
+    if closed:
+        raise ValidationError(
+            'The month of %s is closed' % closed[0].strftime('%Y-%m-%d'))
+
+
+def check_open_change(instance):
+    '''
+    Raise ValidationError if saving the Expense or Attendance would change
+    a closed month: that of its date, or if it exists, its stored date.
+    '''
+    dates = [] if instance.date is None else [instance.date]
+    if instance.pk is not None:
+        dates.extend(type(instance).objects.filter(
+            pk=instance.pk).values_list('date', flat=True))
+    check_open(dates)
+
+
+def close_months(until, user=None):
+    '''
+    Close every open month up to and including the month of until,
+    which must have ended, and save their meal prices and balances.
+
+    Raise ValidationError if the expenses or attendances in the months
+    change while closing them, or if another close creates the same
+    months at the same time. This is still racy: a write that checked
+    check_open() before the close commits, and commits after it, lands
+    in a closed month. Close months after their writes have settled.
+    '''
+    until = until.replace(day=1)
+    end = first_of_next_month(until)
+    if end > timezone.now().date():
+        raise ValidationError('Only months that have ended can be closed')
+    try:
+        _close_months(until, end, user)
+    except IntegrityError:
+        # A concurrent close created one of the months first. With no
+        # ClosedMonth yet, select_for_update() has no row to wait for.
+        raise ValidationError('Months were closed concurrently; ' +
+                              'please try again')
+
+
+def _close_months(until, end, user):
+    with transaction.atomic():
+        # Wait for concurrent closes (on databases with row locks),
+        # then check the open months again.
+        list(ClosedMonth.objects.select_for_update().order_by('-month')[:1])
+        open_from = get_open_from()
+        if open_from is not None and end <= open_from:
+            raise ValidationError('%s is already closed' % until)
+        expense_qs = Expense.objects.filter(date__lt=end)
+        attendance_qs = Attendance.objects.filter(date__lt=end)
+        if open_from is not None:
+            expense_qs = expense_qs.filter(date__gte=open_from)
+            attendance_qs = attendance_qs.filter(date__gte=open_from)
+        expense_qs = expense_qs.order_by('pk')
+        expenses = list(expense_qs.values_list('date', 'person_id', 'amount'))
+        attendances = set(attendance_qs.values_list('date', 'person_id'))
+        meal_prices, balances = compute_month_balances_from_rows(
+            expenses, attendances)
+        start = open_from or min([until] + [d for d, *_ in expenses] +
+                                 [d for d, p in attendances])
+        expense_sums = collections.defaultdict(decimal.Decimal)
+        for date, person_id, amount in expenses:
+            expense_sums[date.year, date.month] += amount
+        meals = collections.Counter(
+            (date.year, date.month) for date, person_id in attendances)
+
+        closed_months = {}
+        month = start.replace(day=1)
+        while month < end:
+            ym = (month.year, month.month)
+            closed_months[ym] = ClosedMonth.objects.create(
+                month=month, expense_sum=expense_sums[ym], meals=meals[ym],
+                closed_by=user)
+            month = first_of_next_month(month)
+        ClosedMonthBalance.objects.bulk_create(
+            ClosedMonthBalance(closed_month=closed_months[ym],
+                               person_id=person_id, balance=balance)
+            for person_id, person_balances in balances.items()
+            for ym, balance in person_balances.items())
+        # Catch writes committed since the snapshot was read.
+        if (expenses != list(expense_qs.values_list(
+                'date', 'person_id', 'amount')) or
+                attendances != set(attendance_qs.values_list(
+                    'date', 'person_id'))):
+            raise ValidationError('Expenses or attendances changed ' +
+                                  'while closing; please try again')
+        data_changed()
+
+
+def reopen_months(since):
+    '''
+    Reopen the month of since and every later month.
+    '''
+    with transaction.atomic():
+        # Wait for concurrent closes (on databases with row locks).
+        list(ClosedMonth.objects.select_for_update().order_by('-month')[:1])
+        ClosedMonth.objects.filter(month__gte=since.replace(day=1)).delete()
+        recompute_balances()
 
 
 class ShoppingListItem(models.Model):
@@ -375,14 +756,16 @@ class Rsvp(models.Model):
     class Meta:
         unique_together = [('date', 'person')]
 
+    def data(self):
+        return {'username': self.person.username,
+                'display_name': self.person.display_name,
+                'status': self.status,
+                'created_time_epoch_ms': dt_to_epoch_ms(self.created_time)}
+
     @classmethod
     def data_for_date(cls, date):
-        qs = cls.objects.filter(date=date).select_related()
-        return [{'username': o.person.username,
-                 'display_name': o.person.display_name,
-                 'status': o.status,
-                 'created_time_epoch_ms': dt_to_epoch_ms(o.created_time)}
-                for o in qs]
+        qs = cls.objects.filter(date=date).select_related('person')
+        return [o.data() for o in qs]
 
     @classmethod
     def set_rsvp(cls, date, person, status):
@@ -394,6 +777,7 @@ class Rsvp(models.Model):
             o = cls(date=date, person=person)
         o.status = status
         o.save()
+        o.person = person  # Avoid a query in o.data()
         # Delay import to avoid import cycle
         import lunchclub.today
-        lunchclub.today.send_current_rsvp()
+        lunchclub.today.send_rsvp(o)
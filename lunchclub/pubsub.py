@@ -0,0 +1,111 @@
+'''
+Groups for sending events to event stream subscribers.
+
+By default groups are Channels groups, which go through the channel layer.
+When the event streams are served by lunchclub.asgi_inprocess, use_hub()
+is called and groups are delivered in-process by a Hub instead.
+'''
+import asyncio
+import threading
+import collections
+
+from channels import Group
+
+
+_hub = None
+
+
+def use_hub(hub):
+    global _hub
+    _hub = hub
+
+
+def get_group(group_name):
+    if _hub is None:
+        return Group(group_name)
+    return HubGroup(_hub, group_name)
+
+
+class HubGroup:
+    '''
+    Like channels.Group, but sends to subscribers of a Hub.
+    '''
+    def __init__(self, hub, name):
+        self.hub = hub
+        self.name = name
+
+    def send(self, message):
+        # Only event streams are served in-process, not WebSockets,
+        # so messages without 'content' have no subscribers.
+        if 'content' in message:
+            self.hub.publish(self.name, message['content'])
+
+
+class Subscriber:
+    '''
+    Queue of event contents for one connection on an asyncio event loop.
+    When closed, or if the client can't keep up, the queue receives None,
+    which tells the connection to close, and the client reconnects
+    with Last-Event-ID.
+    '''
+    def __init__(self, loop, max_size):
+        # Must be created in the thread running the event loop.
+        self.loop = loop
+        self.thread_id = threading.get_ident()
+        self.queue = asyncio.Queue(max_size)
+
+    def put(self, content):
+        try:
+            self.queue.put_nowait(content)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Hub:
+    '''
+    In-process publish/subscribe for event streams.
+    publish() may be called from any thread.
+    '''
+    def __init__(self):
+        self.groups = collections.defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, group_name, subscriber):
+        with self.lock:
+            self.groups[group_name].add(subscriber)
+
+    def unsubscribe(self, group_name, subscriber):
+        with self.lock:
+            subscribers = self.groups.get(group_name)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.groups[group_name]
+
+    def publish(self, group_name, content):
+        with self.lock:
+            subscribers = list(self.groups.get(group_name, ()))
+        by_loop = collections.defaultdict(list)
+        for subscriber in subscribers:
+            by_loop[subscriber.loop, subscriber.thread_id].append(subscriber)
+        for (loop, thread_id), subscribers in by_loop.items():
+            # Wake up each event loop once rather than once per subscriber.
+            if thread_id == threading.get_ident():
+                self.deliver(subscribers, content)
+            else:
+                loop.call_soon_threadsafe(self.deliver, subscribers, content)
+
+    @staticmethod
+    def deliver(subscribers, content):
+        for subscriber in subscribers:
+            subscriber.put(content)
+
+    def subscriber_count(self):
+        with self.lock:
+            return {name: len(subscribers)
+                    for name, subscribers in self.groups.items()}
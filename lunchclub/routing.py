@@ -1,11 +1,19 @@
 # From http://masnun.rocks/2016/09/25/introduction-to-django-channels/
 from channels.routing import route
 from .consumers import chat_stream
-from .consumers import today_events
+from .consumers import today_events, today_state
+from .consumers import today_ws_connect, today_ws_receive, today_ws_disconnect
 from django.conf import settings as _s
 _S = _s.CHANNEL_SUBPATH
 
 channel_routing = [
     route("http.request", chat_stream, path='^' + _S + r"/chat/stream/$"),
     route("http.request", today_events, path='^' + _S + r"/today/events/$"),
+    route("http.request", today_state, path='^' + _S + r"/today/state/$"),
+    route("websocket.connect", today_ws_connect,
+          path='^' + _S + r"/today/ws/$"),
+    route("websocket.receive", today_ws_receive,
+          path='^' + _S + r"/today/ws/$"),
+    route("websocket.disconnect", today_ws_disconnect,
+          path='^' + _S + r"/today/ws/$"),
 ]
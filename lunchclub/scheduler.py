@@ -0,0 +1,109 @@
+import time
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+logger = logging.getLogger('lunchclub')
+
+
+class Job:
+    def __init__(self, name, interval, function):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.next_run = 0
+        self.runs = 0
+        self.failures = 0
+        self.total_time = 0
+        self.max_time = 0
+        self.last_time = None
+
+    def run(self):
+        close_old_connections()
+        start = time.monotonic()
+        try:
+            self.function()
+        except Exception:
+            self.failures += 1
+            logger.exception('Scheduled job %s failed', self.name)
+        elapsed = time.monotonic() - start
+        close_old_connections()
+        self.runs += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.last_time = elapsed
+        # Don't drift, but don't try to catch up on missed runs either.
+        self.next_run += self.interval
+        if self.next_run <= time.monotonic():
+            self.next_run = time.monotonic() + self.interval
+
+    def stats(self):
+        return dict(name=self.name, interval=self.interval,
+                    runs=self.runs, failures=self.failures,
+                    mean_time=self.total_time / self.runs if self.runs else 0,
+                    max_time=self.max_time, last_time=self.last_time)
+
+    def __str__(self):
+        return ('%(name)s: %(runs)s runs, %(failures)s failures, ' +
+                'mean %(mean_ms).1f ms, max %(max_ms).1f ms') % dict(
+                    self.stats(),
+                    mean_ms=1e3 * self.stats()['mean_time'],
+                    max_ms=1e3 * self.max_time)
+
+
+class Scheduler:
+    '''
+    Run functions periodically in a single long-lived process.
+
+    >>> s = Scheduler()
+    >>> runs = []
+    >>> s.add('test', 60, lambda: runs.append(1))
+    >>> s.run_pending()
+    >>> s.run_pending()
+    >>> runs
+    [1]
+    >>> print(s.jobs[0].stats()['runs'])
+    1
+    '''
+    def __init__(self):
+        self.jobs = []
+
+    def add(self, name, interval, function):
+        self.jobs.append(Job(name, interval, function))
+
+    def run_pending(self):
+        for job in self.jobs:
+            if job.next_run <= time.monotonic():
+                job.run()
+
+    def run_forever(self, stats_interval=None):
+        next_stats = time.monotonic() + (stats_interval or 0)
+        while True:
+            self.run_pending()
+            now = time.monotonic()
+            if stats_interval and next_stats <= now:
+                self.log_stats()
+                next_stats = now + stats_interval
+            next_run = min(job.next_run for job in self.jobs)
+            time.sleep(max(0, next_run - time.monotonic()))
+
+    def stats(self):
+        return [job.stats() for job in self.jobs]
+
+    def log_stats(self):
+        for job in self.jobs:
+            logger.info('Scheduler %s', job)
+
+
+def get_default_scheduler():
+    # Delay import since lunchclub.today needs models to be ready
+    import lunchclub.today
+
+    scheduler = Scheduler()
+    scheduler.add('keepalive', settings.EVENT_STREAM_PING_INTERVAL,
+                  lunchclub.today.send_keepalive)
+    scheduler.add('today_state', settings.TODAY_STATE_STEP,
+                  lunchclub.today.expire_state_waits)
+    return scheduler
@@ -85,6 +85,32 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# The cache must be shared if more than one process serves requests.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds to cache the Person of a logged in User (see Person.for_user).
+PERSON_CACHE_TIMEOUT = 300
+
+# Seconds to cache the balance table on Home for a data version.
+BALANCE_TABLE_CACHE_TIMEOUT = 3600
+
+# Seconds to remember a successful access token login (see TokenBackend).
+ACCESS_TOKEN_CACHE_TTL = 60
+
+# Sessions are stored in the database by default. Set
+# LUNCHCLUB_SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies
+# to store them in the cookie instead and save a query on every request.
+SESSION_ENGINE = os.environ.get('LUNCHCLUB_SESSION_ENGINE',
+                                'django.contrib.sessions.backends.db')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -180,3 +206,20 @@ SEND_EMAIL_VIA_MAILTO = True
 RUNNING_IN_HEROKU = False
 
 EVENT_STREAM_PING_INTERVAL = 30
+
+# Seconds to collect RSVP changes before sending them in one event.
+TODAY_COALESCE_WINDOW = 0.5
+
+# Longest wait in seconds for a change in today/state/?wait=T on Daphne.
+TODAY_STATE_MAX_WAIT = 25
+
+# Seconds between the runs of the scheduler job that answers 304 to the
+# waiting today/state/ requests whose wait is over.
+TODAY_STATE_STEP = 5
+
+# Number of recent events per group to replay to reconnecting clients.
+EVENT_BUFFER_SIZE = 100
+
+# Number of events to queue for a slow client in lunchclub.eventstream
+# before closing its connection.
+EVENT_STREAM_QUEUE_SIZE = 100
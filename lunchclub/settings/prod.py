@@ -58,15 +58,47 @@ SERVER_EMAIL = 'courses@apps-server.cs.au.dk'
 
 SEND_EMAIL_VIA_MAILTO = True
 
+# All connections of one Daphne share the capacity of its reply channel,
+# so a group send to more connections than that drops events
+# (see manage.py fanoutbench).
+DAPHNE_CHANNEL_CAPACITY = {
+    "daphne.response.*": 10000,
+}
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "asgi_redis.RedisChannelLayer",
         "CONFIG": {
             "hosts": [("localhost", 6379)],
+            "channel_capacity": DAPHNE_CHANNEL_CAPACITY,
         },
         "ROUTING": "lunchclub.routing.channel_routing",
     },
 }
 
+# Set LUNCHCLUB_CHANNEL_LAYER_PATH (e.g. to /dev/shm/lunchclub-channels.sqlite3)
+# to run Daphne and several workers on this host without a Redis channel layer
+# (the cache below still uses Redis).
+if os.environ.get('LUNCHCLUB_CHANNEL_LAYER_PATH'):
+    CHANNEL_LAYERS["default"] = {
+        "BACKEND": "lunchclub.channel_layer.SQLiteChannelLayer",
+        "CONFIG": {
+            "path": os.environ['LUNCHCLUB_CHANNEL_LAYER_PATH'],
+            "channel_capacity": DAPHNE_CHANNEL_CAPACITY,
+        },
+        "ROUTING": "lunchclub.routing.channel_routing",
+    }
+
+# gunicorn, Daphne and the workers must share data versions, the cached
+# balance table and the person cache. Use the Redis of the channel layer
+# (another database number), so a cache lookup doesn't query the database
+# and cache.incr() is atomic (see lunchclub.version).
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
 CSRF_COOKIE_PATH = SESSION_COOKIE_PATH = '/lunchclub/'
 CSRF_COOKIE_SECURE = SESSION_COOKIE_SECURE = True
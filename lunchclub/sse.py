@@ -1,4 +1,11 @@
 import json
+import threading
+import collections
+
+from django.conf import settings
+
+from lunchclub.pubsub import get_group
+from lunchclub.version import get_version
 
 
 def send_status(channel, status):
@@ -17,19 +24,143 @@ def send_status(channel, status):
     channel.send(reply)
 
 
-def send_event(channel, event, data, more_content=True):
-    channel.send({
-        'content':
-        b'event:%s\ndata:%s\n\n' %
-        (str(event).encode(),
-         str(data).encode()),
-        'more_content': more_content})
+def format_event(event, data, id=None):
+    '''
+    >>> format_event('ping', '')
+    b'event:ping\\ndata:\\n\\n'
+    >>> format_event('chat_message', 'Hi', id=42)
+    b'id:42\\nevent:chat_message\\ndata:Hi\\n\\n'
+    '''
+    prefix = b'' if id is None else b'id:%s\n' % str(id).encode()
+    return (prefix + b'event:%s\ndata:%s\n\n' %
+            (str(event).encode(), str(data).encode()))
+
+
+def format_event_json(event, data, id=None):
+    return format_event(event, json.dumps(data), id)
+
+
+def send_content(channel, content, more_content=True):
+    channel.send({'content': content, 'more_content': more_content})
+
+
+def send_event(channel, event, data, more_content=True, id=None):
+    send_content(channel, format_event(event, data, id), more_content)
+
+
+def send_event_json(channel, event, data, more_content=True, id=None):
+    send_content(channel, format_event_json(event, data, id), more_content)
+
+
+def get_last_event_id(message):
+    for name, value in message.content.get('headers', []):
+        if name.lower() == b'last-event-id':
+            return value.decode('latin1')
+
+
+class EventBuffer:
+    '''
+    Bounded buffer of recent events sent to a group by this process.
+
+    Each event is stored with the id of the event before it, and events
+    are only replayed if the chain of ids is unbroken, since another
+    process may have sent events in between.
+
+    The buffer is per process, so it only helps when the events are sent
+    by the process serving the streams (e.g. lunchclub.eventstream).
+    In the gunicorn + Daphne deployment in systemd/, views broadcast from
+    gunicorn and streams are served by runworker, so replay never finds
+    the events there and reconnecting clients get the full state.
+
+    >>> b = EventBuffer(3)
+    >>> b.append(None, 1, b'a')
+    >>> b.append(1, 2, b'b')
+    >>> b.append(2, 3, b'c')
+    >>> b.since('1')
+    [b'b', b'c']
+    >>> b.since('3')
+    []
+    >>> b.append(3, 4, b'd')
+    >>> b.since('1')
+    [b'b', b'c', b'd']
+    >>> print(b.since('0'))
+    None
+    >>> b.append(10, 11, b'x')
+    >>> print(b.since('3'))
+    None
+    >>> b.since('10', current_id='11')
+    [b'x']
+    >>> print(b.since('10', current_id='12'))
+    None
+    '''
+    def __init__(self, size):
+        self.events = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def append(self, prev_id, id, content):
+        prev_id = None if prev_id is None else str(prev_id)
+        with self.lock:
+            self.events.append((prev_id, str(id), content))
+
+    def since(self, last_id, current_id=None):
+        '''
+        Return the contents of the events after the event with id last_id,
+        or None if they are not all in the buffer.
+        If current_id is given, the last event in the buffer must have
+        that id, since otherwise another process has sent later events.
+        '''
+        with self.lock:
+            events = list(self.events)
+        if current_id is not None and (not events or
+                                       events[-1][1] != current_id):
+            return None
+        if events and events[-1][1] == last_id:
+            return []
+        result = None
+        for prev_id, id, content in events:
+            if result is None:
+                if prev_id == last_id:
+                    result = [content]
+            elif prev_id == expected_prev_id:
+                result.append(content)
+            else:
+                return None
+            expected_prev_id = id
+        return result
+
+
+_event_buffers = {}
+
+
+def get_event_buffer(group_name):
+    try:
+        return _event_buffers[group_name]
+    except KeyError:
+        return _event_buffers.setdefault(
+            group_name, EventBuffer(settings.EVENT_BUFFER_SIZE))
+
+
+def broadcast(group_name, content, prev_id, id):
+    '''
+    Send an event with the given id to a group and remember it,
+    so it can be replayed to clients that reconnect with Last-Event-ID.
+    '''
+    get_event_buffer(group_name).append(prev_id, id, content)
+    send_content(get_group(group_name), content)
 
 
-def send_event_json(channel, event, data, more_content=True):
-    channel.send({
-        'content':
-        b'event:%s\ndata:%s\n\n' %
-        (str(event).encode(),
-         json.dumps(data).encode()),
-        'more_content': more_content})
+def get_missed_events(group_name, last_event_id, current_id=None):
+    '''
+    Return the contents of the events sent to the group after the event
+    with id last_event_id, or None if they are not known.
+    current_id is the id of the latest event sent to the group,
+    by default the version named like the group.
+    '''
+    if last_event_id is None:
+        return None
+    if current_id is None:
+        current_id = str(get_version(group_name))
+    if last_event_id == current_id:
+        # Nothing has happened since then.
+        return []
+    return get_event_buffer(group_name).since(last_event_id, current_id)
@@ -1,16 +1,102 @@
-from django.utils import timezone
+import json
+import time
+import atexit
+import datetime
+import itertools
+import threading
+import collections
+
 from channels import Group
-from lunchclub.sse import send_event, send_event_json
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from lunchclub.sse import (
+    send_event, send_content, format_event_json, broadcast,
+    get_missed_events,
+)
 from lunchclub.models import Rsvp, Announce
+from lunchclub.pubsub import get_group
+from lunchclub.version import get_version, bump_version
+
+
+GROUP = 'today_events'
+
+# WebSocket connections of the today widget, which receive the same
+# events as GROUP, but as compact JSON frames (see format_frame).
+WS_GROUP = 'today_ws'
+
+# Version of today's RSVPs and announcements.
+# Every event broadcast to GROUP has an id made by get_event_id()
+# from its date and the new version.
+VERSION = 'today'
+
+# today/state/?wait=T requests served by Daphne wait in the group of the
+# TODAY_STATE_STEP-second step in which their wait is over. A change
+# answers the waiting requests with the new state, and the scheduler job
+# expire_state_waits() answers 304 to the steps that are over.
+# These are always Channels groups, since the in-process Hub only
+# serves event streams.
+STATE_GROUP = 'today_state_%s'
+
+
+def get_event_id(date, version):
+    '''
+    Return the id of an event of the given date and version.
+    Since it contains the date, the first change of a day doesn't
+    continue the events of the day before, so reconnecting clients
+    get the full state instead of the changes.
+
+    >>> get_event_id(datetime.date(2026, 10, 19), 1792368953481)
+    '2026-10-19/1792368953481'
+    '''
+    return '%s/%s' % (date.isoformat(), version)
 
 
 def send_keepalive():
-    send_event(Group('today_events'), 'ping', '')
+    send_event(get_group(GROUP), 'ping', '')
 
 
 def send_current_rsvp(channel=None):
+    '''
+    Send a "query" event with the full state of today,
+    which subscribers receive when they connect.
+    Changes are sent as "rsvps" and "notification" events.
+    '''
     if channel is None:
-        channel = Group('today_events')
+        channel = get_group(GROUP)
+
+    send_content(channel, get_current_rsvp_content())
+
+
+def format_frame(event, data):
+    '''
+    Encode an event as a WebSocket text frame.
+
+    >>> format_frame('ack', {'id': 1})
+    '["ack",{"id":1}]'
+    '''
+    return json.dumps([event, data], separators=(',', ':'))
+
+
+# The (date, version) of the last "query" event and its encodings
+# as SSE content, as WebSocket frame and as JSON.
+_current_rsvp_cache = (None, None)
+
+
+def get_current_rsvp():
+    '''
+    Return the "query" event for the current version as a triple
+    (SSE content, WebSocket frame, JSON).
+    '''
+    global _current_rsvp_cache
+
+    today = timezone.now().date()
+    # Get the version before the data, so a change that happens
+    # in between is sent again rather than missed.
+    version = get_version(VERSION)
+    key, encoded = _current_rsvp_cache
+    if key == (today, version):
+        return encoded
 
     msg = 'Do you want lunch today?'
     rsvp_options = [
@@ -21,16 +107,193 @@ def send_current_rsvp(channel=None):
         {'key': key, 'label': label}
         for key, label in Announce.KIND
     ]
-    today = timezone.now().date()
     data = {'msg': msg, 'rsvp_options': rsvp_options, 'announce': announce,
             'announcement': Announce.current_notification_for_date(today),
-            'rsvps': Rsvp.data_for_date(today)}
+            'rsvps': Rsvp.data_for_date(today),
+            'version': version, 'date': today.isoformat()}
+    encoded = (format_event_json('query', data,
+                                 id=get_event_id(today, version)),
+               format_frame('query', data),
+               json.dumps(data))
+    _current_rsvp_cache = ((today, version), encoded)
+    return encoded
 
-    send_event_json(channel, 'query', data)
 
+def get_current_rsvp_content():
+    return get_current_rsvp()[0]
+
+
+def get_current_rsvp_frame():
+    return get_current_rsvp()[1]
+
+
+def get_current_rsvp_json():
+    return get_current_rsvp()[2]
+
+
+def get_state_step(t):
+    return int(t // settings.TODAY_STATE_STEP)
+
+
+def send_state(channel, status):
+    '''
+    Send a complete response to a today/state/ request: the state of
+    today as JSON if status is 200, or nothing if it is 304.
+    '''
+    headers = [('Cache-Control', 'no-cache')]
+    content = b''
+    if status == 200:
+        headers.append(('Content-Type', 'application/json'))
+        content = get_current_rsvp_json().encode()
+    channel.send({'status': status, 'headers': headers, 'content': content})
+
+
+def wait_for_state(channel, wait):
+    '''
+    Add a today/state/ request to the group that is answered when
+    the state changes, or with 304 after about wait seconds.
+    '''
+    wait = min(wait, settings.TODAY_STATE_MAX_WAIT)
+    # Never join a step that expire_state_waits() may have done already.
+    step = (get_state_step(time.time()) +
+            max(1, int(wait // settings.TODAY_STATE_STEP)))
+    group = Group(STATE_GROUP % step)
+    group.add(channel)
+    return group
+
+
+# The last step answered by expire_state_waits() in this process.
+_expired_state_step = None
+
+
+def expire_state_waits():
+    global _expired_state_step
+
+    step = get_state_step(time.time())
+    if _expired_state_step is None:
+        # After a restart, also answer the requests of the steps missed.
+        first = step - get_state_step(settings.TODAY_STATE_MAX_WAIT) - 1
+    else:
+        first = _expired_state_step + 1
+    for s in range(first, step + 1):
+        send_state(Group(STATE_GROUP % s), 304)
+    _expired_state_step = step
+
+
+def send_state_change():
+    # The groups of the steps that may have waiting requests.
+    step = get_state_step(time.time())
+    last = step + get_state_step(settings.TODAY_STATE_MAX_WAIT) + 1
+    for s in range(step, last + 1):
+        send_state(Group(STATE_GROUP % s), 200)
+
+
+def get_missed_today_events(last_event_id):
+    current_id = get_event_id(timezone.now().date(), get_version(VERSION))
+    return get_missed_events(GROUP, last_event_id, current_id)
+
+
+def broadcast_change(event, data, date):
+    '''
+    Send a change of the given date to the subscribers.
+    Clients must ignore changes of another date than their state and
+    ask for the full state instead.
+    '''
+    old_version, version = bump_version(VERSION)
+    data = dict(data, version=version, date=date.isoformat())
+    old_id = None if old_version is None else get_event_id(date, old_version)
+    id = get_event_id(date, version)
+    broadcast(GROUP, format_event_json(event, data, id=id), old_id, id)
+    get_group(WS_GROUP).send({'text': format_frame(event, data)})
+    send_state_change()
+
+
+def apply_update(person, kind, key):
+    '''
+    Set the RSVP of person for today (kind "rsvp_options") or make an
+    announcement (kind "announce"). Raise ValueError if kind or key is invalid.
+    '''
+    choices = {'rsvp_options': Rsvp.STATUS, 'announce': Announce.KIND}
+    # kind and key may come from JSON, so they need not be hashable.
+    if not isinstance(kind, str) or kind not in choices:
+        raise ValueError('Invalid "kind"')
+    if not isinstance(key, str) or key not in (k for k, l in choices[kind]):
+        raise ValueError('Invalid "key"')
+    now = timezone.now()
+    if kind == 'rsvp_options':
+        Rsvp.set_rsvp(now.date(), person, key)
+    else:
+        Announce.create(now, person, key)
+
+
+class Coalescer:
+    '''
+    Collect items for a short window and pass them to flush() together.
+    The first item starts the window, so no item waits longer than that.
+    Of items added with the same key, only the last one is kept.
+
+    Pending items are flushed when the process exits normally, but they
+    are lost if it is killed before the window ends.
+
+    >>> flushed = []
+    >>> c = Coalescer(0, flushed.append)
+    >>> c.add('foo', 1)
+    >>> flushed
+    [[1]]
+    '''
+    def __init__(self, window, flush):
+        self.window = window
+        self.flush_function = flush
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.timer = None
+
+    def add(self, key, item):
+        if self.window <= 0:
+            self.flush_function([item])
+            return
+        with self.lock:
+            self.pending.pop(key, None)
+            self.pending[key] = item
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            items = list(self.pending.values())
+            self.pending.clear()
+            self.timer = None
+        if items:
+            self.flush_function(items)
+
+    def flush_timer(self):
+        try:
+            self.flush()
+        finally:
+            # flush_function may have used the database in this thread,
+            # which opens a connection that nothing else would close.
+            connections.close_all()
+
+
+def send_rsvps(items):
+    # Usually all items have the same date, but not around midnight.
+    for date, date_items in itertools.groupby(items, key=lambda o: o[0]):
+        broadcast_change('rsvps', {'rsvps': [o[1] for o in date_items]},
+                         date)
+
+
+rsvp_coalescer = Coalescer(settings.TODAY_COALESCE_WINDOW, send_rsvps)
+atexit.register(rsvp_coalescer.flush)
+
+
+def send_rsvp(rsvp: 'Rsvp'):
+    # Get the data now, since the coalescer sends it in another thread.
+    rsvp_coalescer.add((rsvp.date, rsvp.person_id),
+                       (rsvp.date, rsvp.data()))
 
-def send_notification(announce: 'Announce', channel=None):
-    if channel is None:
-        channel = Group('today_events')
 
-    send_event_json(channel, 'notification', announce.notification())
+def send_notification(announce: 'Announce'):
+    broadcast_change('notification', announce.notification(),
+                     announce.created_time.date())
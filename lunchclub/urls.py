@@ -21,21 +21,23 @@ from django.views.generic import TemplateView
 from lunchclub.views import (
     Home, DatabaseBulkEdit, Login, Logout, AccessTokenList,
     ExpenseCreate, AttendanceToday, AttendanceCreate,
-    AttendanceExport, ExpenseExport, submit_view,
+    AttendanceExport, ExpenseExport, submit_view, submit_batch_view,
     ShoppingList, chat_publish,
-    today_update,
-    DatabaseView,
+    today_update, today_state,
+    DatabaseView, CloseMonths, balances_json,
 )
-from roomcalendar.views import CalendarUpdate
+from roomcalendar.views import CalendarUpdate, CalendarFree
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^$', Home.as_view(), name='home'),
     url(r'^view/$', DatabaseView.as_view(), name='database_view'),
     url(r'^edit/$', DatabaseBulkEdit.as_view(), name='edit'),
+    url(r'^close/$', CloseMonths.as_view(), name='close_months'),
     url(r'^export/attenddb\.txt$', AttendanceExport.as_view(), name='attendance_export'),
     url(r'^export/expensedb\.txt$', ExpenseExport.as_view(), name='expense_export'),
     url(r'^export/expencedb\.txt$', ExpenseExport.as_view(), name='expense_export_sic'),
+    url(r'^export/balances\.json$', balances_json, name='balances_json'),
     url(r'^login/$', Login.as_view(), name='login'),
     url(r'^logout/$', Logout.as_view(), name='logout'),
     url(r'^token/$', AccessTokenList.as_view(), name='accesstoken_list'),
@@ -43,9 +45,12 @@ urlpatterns = [
     url(r'^attendance/today/$', AttendanceToday.as_view(), name='attendance_today'),
     url(r'^attendance/$', AttendanceCreate.as_view(), name='attendance_create'),
     url(r'^clisubmit/$', submit_view),
+    url(r'^clisubmit/batch/$', submit_batch_view),
     url(r'^shoppinglist/$', ShoppingList.as_view(), name='shopping_list'),
     url(r'^chat/$', TemplateView.as_view(template_name='chat.html')),
     url(r'^chat/publish/$', chat_publish),
     url(r'^today/update/$', today_update),
+    url(r'^today/state/$', today_state),
     url(r'^calendar/update/$', CalendarUpdate.as_view()),
+    url(r'^calendar/free/$', CalendarFree.as_view()),
 ]
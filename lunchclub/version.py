@@ -0,0 +1,55 @@
+'''
+Data versions kept in the Django cache.
+
+A version is a millisecond timestamp that is increased on every change.
+If the cache forgets a version, it restarts at the current time,
+so clients comparing versions still notice that something may have changed.
+
+Versions are increased with cache.incr(), which must be atomic, so that
+concurrent bumps in different processes get distinct versions. It is on
+Redis (see settings/prod.py) and memcached, and within one process on
+LocMemCache, but not on DatabaseCache.
+'''
+import time
+
+from django.core.cache import cache
+
+
+def version_key(name):
+    return 'lunchclub:version:%s' % name
+
+
+def now_ms():
+    return int(time.time() * 1e3)
+
+
+def get_version(name):
+    key = version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, now_ms(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    '''
+    Increase the version and return the (old, new) pair.
+    The old version is None if the cache had forgotten it.
+    '''
+    key = version_key(name)
+    new = now_ms()
+    if cache.add(key, new, None):
+        return None, new
+    old = cache.get(key)
+    # Follow the clock, but always increase. Concurrent bumps may both
+    # add the time since old, which puts the version ahead of the clock
+    # until the clock catches up; the versions are distinct in any case.
+    delta = max(1, new - old) if old is not None else 1
+    try:
+        new = cache.incr(key, delta)
+    except ValueError:
+        # Forgotten in the meantime
+        return bump_version(name)
+    # incr() is atomic, so this was the version just before ours.
+    return new - delta, new
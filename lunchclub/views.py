@@ -9,8 +9,14 @@ import datetime
 import functools
 
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.core.cache import cache
 from django.utils.decorators import method_decorator
 from django.utils import timezone
+from django.utils.http import urlencode
 from django.utils.crypto import constant_time_compare
 from django.shortcuts import redirect
 from django.views.generic import TemplateView, FormView, View
@@ -19,28 +25,34 @@ from django.http import (
     HttpResponseNotModified,
 )
 from django.views.defaults import permission_denied
-from django.db.models import Q, F
+from django.core.paginator import Paginator, EmptyPage
+from django.db import transaction
+from django.db.models import F, Min
+from django.core.exceptions import ValidationError
 from django.contrib.auth import authenticate, login, logout
 from django.conf import settings
 
-from channels import Group
-
 from lunchclub.forms import (
-    DatabaseBulkEditForm, AccessTokenListForm, SearchForm, ExpenseCreateForm,
+    DatabaseBulkEditForm, AccessTokenListForm, AccessTokenFilterForm,
+    SearchForm, ExpenseCreateForm, CloseMonthsForm,
     AttendanceTodayForm, AttendanceCreateForm, MonthForm, ShoppingListForm,
 )
 from lunchclub.models import (
-    Person, Expense, Attendance, AccessToken, ShoppingListItem, Rsvp, Announce,
+    Person, Expense, Attendance, AccessToken, ShoppingListItem, Rsvp,
 )
 from lunchclub.models import (
-    get_average_meal_price, compute_month_balances, recompute_balances,
+    get_average_meal_price, compute_balances_since, recompute_balances,
+    DATA_VERSION, ClosedMonth, get_open_from, first_of_next_month,
 )
 from lunchclub.parser import (
     get_attenddb_from_model, get_expensedb_from_model,
     unparse_attenddb, unparse_expensedb,
 )
+from lunchclub.sse import format_event, broadcast
+from lunchclub.version import get_version, bump_version
+import lunchclub.today
 import lunchclub.mail
-from roomcalendar.models import Calendar
+from roomcalendar.models import get_today_items, VERSION as CALENDAR_VERSION
 
 
 logger = logging.getLogger('lunchclub')
@@ -65,9 +77,8 @@ def dispatch_person_required(function):
     def dispatch(request, *args, **kwargs):
         if not request.user.is_authenticated():
             return permission_denied(request, exception=None)
-        try:
-            request.person = Person.objects.get(user=request.user)
-        except Person.DoesNotExist:
+        request.person = Person.for_user(request.user)
+        if request.person is None:
             return permission_denied(request, exception=None)
         return function(request, *args, **kwargs)
 
@@ -85,54 +96,193 @@ def get_months(months):
     return [(y, m + 1) for y, m in yms]
 
 
+def get_balance_data(months, show_all):
+    '''
+    Return the data of the balance table on Home for the last months
+    months as a dict with keys:
+
+        - months: list of (y, m), the current month first
+        - prices: the meal price of each month
+        - total_price: the average meal price over all time
+        - persons: list of (username, display_name, balance, deltas)
+          ordered by balance, where deltas are the balance changes
+          in each month
+
+    Used by the Home view and balances_json.
+    '''
+    months = get_months(months)
+    earliest_year, earliest_month = min(months)
+    earliest_date = datetime.date(earliest_year, earliest_month, 1)
+    meal_prices, balances = compute_balances_since(earliest_date)
+    prices = [meal_prices.get(ym, 0) for ym in months]
+
+    if show_all:
+        person_qs = Person.objects.all()
+    else:
+        person_qs = Person.filter_active()
+    person_qs = person_qs.order_by('balance')
+    person_qs = person_qs.values_list(
+        'id', 'username', 'display_name', 'balance')
+    persons = [
+        (username, display_name, balance,
+         [balances[person_id][ym] for ym in months])
+        for person_id, username, display_name, balance in person_qs]
+
+    return dict(months=months, prices=prices,
+                total_price=get_average_meal_price(), persons=persons)
+
+
+def get_balance_table_context(months, show_all):
+    data = get_balance_data(months, show_all)
+    month_data = [dict(name='%04d-%02d' % ym, price=price)
+                  for ym, price in zip(data['months'], data['prices'])]
+    person_data = [
+        dict(username=username, balance=balance, display_name=display_name,
+             months=[dict(balance=delta) for delta in deltas])
+        for username, display_name, balance, deltas in data['persons']]
+    return dict(total_price=data['total_price'], months=month_data,
+                persons=person_data)
+
+
+def get_search_data(query):
+    '''
+    Return the cleaned data of a SearchForm for the query,
+    or the defaults if it is invalid.
+    '''
+    search_form = SearchForm(data=query or None)
+    if search_form.is_valid():
+        return search_form.cleaned_data
+    f = SearchForm(data={})
+    if not f.is_valid():
+        raise AssertionError('Blank SearchForm is not valid')
+    return f.cleaned_data
+
+
+def get_balance_table(months, show_all):
+    '''
+    Return the balance table on Home as HTML.
+
+    The HTML is cached until the data version changes.
+    '''
+    # Get the version before the data, like lunchclub.today.
+    version = get_version(DATA_VERSION)
+    # The months shown depend on the current month.
+    key = 'lunchclub:balance_table:%s:%s:%s:%s' % (
+        version, '%04d-%02d' % get_months(1)[0], months, bool(show_all))
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('lunchclub/balance_table.html',
+                                get_balance_table_context(months, show_all))
+        cache.set(key, html, settings.BALANCE_TABLE_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+def get_home_validators(request):
+    '''
+    Return the (ETag, Last-Modified) of Home for the request.
+    '''
+    try:
+        return request.home_validators
+    except AttributeError:
+        pass
+    versions = [get_version(DATA_VERSION),
+                get_version(CALENDAR_VERSION)]
+    # get_months() uses the local date and the calendar uses the UTC date.
+    dates = [datetime.date.today(), timezone.now().date()]
+    # get_token() returns a new masking of the CSRF secret every time,
+    # but every masking is valid, so only the cookie is part of the ETag.
+    get_token(request)
+    key = [request.user.pk, request.META['CSRF_COOKIE'],
+           request.GET.urlencode()]
+    etag = hashlib.sha1(repr(versions + dates + key).encode()).hexdigest()
+    # Also modified when the date changes.
+    midnight = timezone.make_aware(
+        datetime.datetime.combine(datetime.date.today(), datetime.time()))
+    last_modified = max(
+        [midnight] + [datetime.datetime.fromtimestamp(v / 1e3, timezone.utc)
+                      for v in versions])
+    request.home_validators = etag, last_modified
+    return request.home_validators
+
+
+def format_amount(v):
+    '''
+    Round an amount to cents for JSON (None if infinite).
+
+    >>> format_amount(decimal.Decimal('8.795')), format_amount(float('inf'))
+    (8.8, None)
+    '''
+    if v == float('inf'):
+        return None
+    return float(round(decimal.Decimal(v), 2))
+
+
+def get_balances_json_key(request):
+    try:
+        return request.balances_json_key
+    except AttributeError:
+        pass
+    search_data = get_search_data(request.GET)
+    # Get the version before the data, like lunchclub.today.
+    request.balances_json_key = 'lunchclub:balances_json:%s:%s:%s:%s' % (
+        get_version(DATA_VERSION), '%04d-%02d' % get_months(1)[0],
+        search_data['months'], bool(search_data['show_all']))
+    return request.balances_json_key
+
+
+@condition(etag_func=lambda request: hashlib.sha1(
+    get_balances_json_key(request).encode()).hexdigest())
+def balances_json(request):
+    '''
+    Return the balance table on Home as column-oriented JSON.
+    Takes the same ?months= and ?show_all= as Home.
+
+    "months" and "prices" are parallel lists, and so are the lists in
+    "persons". "deltas" has a list for each month with the balance
+    change of each person in that month. The response is cached
+    until the data version changes.
+    '''
+    key = get_balances_json_key(request)
+    content = cache.get(key)
+    if content is None:
+        search_data = get_search_data(request.GET)
+        data = get_balance_data(search_data['months'],
+                                search_data['show_all'])
+        persons = data['persons']
+        result = {
+            'months': ['%04d-%02d' % ym for ym in data['months']],
+            'prices': [format_amount(p) for p in data['prices']],
+            'total_price': format_amount(data['total_price']),
+            'persons': {
+                'username': [p[0] for p in persons],
+                'display_name': [p[1] for p in persons],
+                'balance': [format_amount(p[2]) for p in persons],
+            },
+            'deltas': [[format_amount(p[3][i]) for p in persons]
+                       for i in range(len(data['months']))],
+        }
+        content = json.dumps(result, separators=(',', ':')).encode()
+        cache.set(key, content, settings.BALANCE_TABLE_CACHE_TIMEOUT)
+    response = HttpResponse(content, content_type='application/json')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@method_decorator(condition(
+    etag_func=lambda request: get_home_validators(request)[0],
+    last_modified_func=lambda request: get_home_validators(request)[1]),
+    name='get')
 class Home(TemplateView):
     template_name = 'lunchclub/home.html'
 
     def get_context_data(self, **kwargs):
         data = super(Home, self).get_context_data(**kwargs)
 
-        data['search_form'] = search_form = SearchForm(
-            data=self.request.GET or None)
-        if search_form.is_valid():
-            search_data = search_form.cleaned_data
-        else:
-            f = SearchForm(data={})
-            if not f.is_valid():
-                raise AssertionError('Blank SearchForm is not valid')
-            search_data = f.cleaned_data
-        months = get_months(search_data['months'])
-        earliest_year, earliest_month = min(months)
-        earliest_date = datetime.date(earliest_year, earliest_month, 1)
-        date_filter = Q(date__gte=earliest_date)
-        expense_qs = Expense.objects.filter(date_filter)
-        attendance_qs = Attendance.objects.filter(date_filter)
-        meal_prices, balances = compute_month_balances(expense_qs,
-                                                       attendance_qs)
-        month_data = []
-        for (y, m) in months:
-            name = '%04d-%02d' % (y, m)
-            price = meal_prices.setdefault((y, m), 0)
-            month_data.append(dict(name=name, price=price))
-        data['total_price'] = get_average_meal_price()
-        data['months'] = month_data
-
-        person_data = []
-        if search_data['show_all']:
-            person_qs = Person.objects.all()
-        else:
-            person_qs = Person.filter_active()
-        person_qs = person_qs.order_by('balance')
-        for person in person_qs:
-            person_months = []
-            for (y, m) in months:
-                person_months.append(dict(balance=balances[person.id][y, m]))
-            person_data.append(dict(
-                username=person.username, balance=person.balance,
-                display_name=person.display_name,
-                months=person_months))
-
-        data['persons'] = person_data
-        data['calendars'] = Calendar.objects.all().order_by('name')
+        data['search_form'] = SearchForm(data=self.request.GET or None)
+        search_data = get_search_data(self.request.GET)
+        data['balance_table'] = get_balance_table(
+            search_data['months'], search_data['show_all'])
+        data['calendar_items'] = get_today_items()
         return data
 
 
@@ -196,6 +346,55 @@ class DatabaseBulkEdit(FormView):
         return redirect('home')
 
 
+@superuser_required
+class CloseMonths(FormView):
+    '''
+    Close past months, so that their expenses and attendances can no longer
+    be changed and balances are computed from a snapshot, or reopen them.
+    '''
+    form_class = CloseMonthsForm
+    template_name = 'lunchclub/closemonths.html'
+
+    def get_close_choices(self):
+        start = get_open_from()
+        if start is None:
+            dates = [qs.aggregate(d=Min('date'))['d']
+                     for qs in (Expense.objects, Attendance.objects)]
+            dates = [d for d in dates if d is not None]
+            if not dates:
+                return []
+            start = min(dates).replace(day=1)
+        end = timezone.now().date().replace(day=1)
+        months = []
+        while start < end:
+            months.append(start)
+            start = first_of_next_month(start)
+        return months[::-1]
+
+    def get_form_kwargs(self, **kwargs):
+        form_kwargs = super().get_form_kwargs(**kwargs)
+        form_kwargs['close_choices'] = self.get_close_choices()
+        form_kwargs['reopen_choices'] = [
+            o.month for o in ClosedMonth.objects.order_by('-month')]
+        return form_kwargs
+
+    def get_context_data(self, **kwargs):
+        context_data = super().get_context_data(**kwargs)
+        context_data['closed_months'] = ClosedMonth.objects.order_by('-month')
+        return context_data
+
+    def form_valid(self, form):
+        try:
+            form.save(self.request.user)
+        except ValidationError as exn:
+            form.add_error(None, exn)
+            return self.form_invalid(form)
+        logger.info("%s: Close %s, reopen %s",
+                    self.request.user.username,
+                    form.cleaned_data['close'], form.cleaned_data['reopen'])
+        return redirect('close_months')
+
+
 class Logout(TemplateView):
     template_name = 'lunchclub/logout.html'
 
@@ -237,7 +436,7 @@ class Login(TemplateView):
 
     def post(self, request, user, token):
         logger.info("Login %s with token %s", user, token[:20])
-        qs = AccessToken.objects.filter(token=token)
+        qs = AccessToken.objects.filter(digest=AccessToken.make_digest(token))
         qs.update(use_count=F('use_count') + 1)
         login(request, user)
         return redirect('home')
@@ -247,12 +446,38 @@ class Login(TemplateView):
 class AccessTokenList(FormView):
     form_class = AccessTokenListForm
     template_name = 'lunchclub/accesstokenlist.html'
+    paginate_by = 50
+
+    def get_filter_form(self):
+        return AccessTokenFilterForm(data=self.request.GET or None)
+
+    def get_page(self):
+        filter_form = self.get_filter_form()
+        qs = AccessToken.annotate_latest(Person.objects.all())
+        page_number = 1
+        if filter_form.is_valid():
+            qs = filter_form.filter(qs)
+            page_number = filter_form.cleaned_data['page'] or 1
+        paginator = Paginator(qs, self.paginate_by)
+        try:
+            return paginator.page(page_number)
+        except EmptyPage:
+            return paginator.page(paginator.num_pages)
 
     def get_form_kwargs(self, **kwargs):
         form_kwargs = super().get_form_kwargs(**kwargs)
-        form_kwargs['queryset'] = Person.objects.all()
+        self.page = self.get_page()
+        form_kwargs['queryset'] = self.page.object_list
         return form_kwargs
 
+    def get_context_data(self, **kwargs):
+        context_data = super().get_context_data(**kwargs)
+        filter_form = context_data['filter_form'] = self.get_filter_form()
+        context_data['page'] = self.page
+        q = filter_form.cleaned_data['q'] if filter_form.is_valid() else ''
+        context_data['page_query'] = urlencode({'q': q}) if q else ''
+        return context_data
+
     def form_valid(self, form: AccessTokenListForm):
         changes, messages = form.actions()
         for s, *args in changes.log_entries():
@@ -335,6 +560,9 @@ class AttendanceCreate(FormView):
     def get_month_range(self):
         now = timezone.now()
         earliest = (now.year - 2, now.month)
+        open_from = get_open_from()
+        if open_from is not None:
+            earliest = max(earliest, (open_from.year, open_from.month))
         current_month = (now.year, now.month)
         return earliest, current_month
 
@@ -357,7 +585,9 @@ class AttendanceCreate(FormView):
     def get_month_form(self):
         current_date = timezone.now().day
         choices = list(self.iter_months())
-        initial_month = choices[0] if current_date >= 10 else choices[1]
+        # The previous month, if it is still open, until the 10th.
+        initial_month = choices[0 if current_date >= 10 else
+                                min(1, len(choices) - 1)]
         return MonthForm(choices=choices, initial_month=initial_month,
                          data=self.request.GET or None)
 
@@ -407,34 +637,95 @@ class AttendanceCreate(FormView):
         return context_data
 
 
+# Payloads generated by lunchclub_backend in lunchclub2015
+EXPENSE_PATTERN = re.compile(
+    r'^expense\s+(\d+)\s+(\d+)\s+(\d+)\s+' +
+    r'(\d+\.\d+)\s+([a-z0-9]+)$')
+ATTENDANCE_PATTERN = re.compile(
+    r'^attendance (\d+)\s+(\d+)\s+([a-z0-9]+)\s+' +
+    r'([a-z0-9]+)((?:\s+\d+)+)$')
+TOKEN_PATTERN = re.compile(r'^token (\d+)\s+(\d+)\s+(\d+)\s+([a-z0-9]+)$')
+
+
+class SubmitState:
+    '''
+    State shared by the save() functions returned by Submit.parse_payload():
+    Persons are looked up once, and balances are recomputed once at the end.
+    '''
+    def __init__(self):
+        self.persons = None
+        self.recompute = False
+        self.open_from = None
+
+    def is_closed(self, dates):
+        if self.open_from is None:
+            # The first day after the closed months (date.min if none)
+            self.open_from = get_open_from() or datetime.date.min
+        return any(d < self.open_from for d in dates)
+
+    def get_person(self, username):
+        if self.persons is None:
+            self.persons = {p.username: p for p in Person.objects.all()}
+        return self.persons.get(username)
+
+    def get_or_create_person(self, username):
+        person = self.get_person(username)
+        if person is None:
+            person = self.persons[username] = Person.get_or_create(username)
+        return person
+
+
 class Submit(View):
     def post(self, request):
         b64data = request.POST.get('payload')
         if b64data is None:
             return HttpResponseBadRequest('Missing "payload" parameter')
+        save_payload = self.verify_payload(b64data)
+        if isinstance(save_payload, str):
+            return HttpResponseBadRequest(save_payload)
+
+        state = SubmitState()
+        with transaction.atomic():
+            result = self.result_dict(save_payload(state))
+            if state.recompute:
+                recompute_balances()
+        # Return the message that lunchclub2015 expects
+        if 'error' in result:
+            return HttpResponseBadRequest(json.dumps(result))
+        return HttpResponse(json.dumps(result))
+
+    def verify_payload(self, b64data):
+        '''
+        Return a save() function for a base64-encoded signed payload,
+        or a string describing why it is invalid.
+        '''
         try:
             data = base64.b64decode(b64data.encode('ascii'))
         except (ValueError, UnicodeEncodeError):
-            return HttpResponseBadRequest('Invalid base64 data')
+            return 'Invalid base64 data'
         input_mac = data[:64]
         payload = data[64:]
         save_payload = self.parse_payload(payload)
         if save_payload is None:
-            return HttpResponseBadRequest('Failed to parse payload')
+            return 'Failed to parse payload'
         mac = hmac.new(settings.SUBMISSION_KEY,
                        payload,
                        hashlib.sha512).digest()
         if not constant_time_compare(input_mac, mac):
-            return HttpResponseBadRequest('MAC failed')
-
-        result = save_payload()
-        if isinstance(result, HttpResponse):
-            return result
-        elif result is None:
-            # Return the message that lunchclub2015 expects
-            return HttpResponse(json.dumps({'success': True}))
+            return 'MAC failed'
+        return save_payload
+
+    @staticmethod
+    def result_dict(result):
+        '''
+        Convert the return value of a save() function to a JSON-able dict.
+        '''
+        if result is None:
+            return {'success': True}
+        elif isinstance(result, dict):
+            return dict(success=True, **result)
         else:
-            return HttpResponseBadRequest(json.dumps({'error': result}))
+            return {'error': result}
 
     def parse_payload(self, payload):
         try:
@@ -442,21 +733,22 @@ class Submit(View):
         except UnicodeDecodeError:
             return
 
-        # Parse payload generated by lunchclub_backend in lunchclub2015
-        expense_pattern = (r'^expense\s+(\d+)\s+(\d+)\s+(\d+)\s+' +
-                           r'(\d+\.\d+)\s+([a-z0-9]+)$')
-        mo = re.match(expense_pattern, payload)
+        mo = EXPENSE_PATTERN.match(payload)
         if mo:
             year, month, day = map(int, mo.group(1, 2, 3))
-            date = datetime.date(year, month, day)
+            try:
+                date = datetime.date(year, month, day)
+            except ValueError:
+                return 'Invalid date'
             amount = decimal.Decimal(mo.group(4))
             username = mo.group(5)
 
-            def save():
-                try:
-                    person = Person.objects.get(username=username)
-                except Person.DoesNotExist:
+            def save(state):
+                person = state.get_person(username)
+                if person is None:
                     return '%r does not exist' % (username,)
+                if state.is_closed([date]):
+                    return 'Month is closed'
                 existing = Expense.objects.filter(
                     date=date, person=person, amount=amount)
                 if existing.exists():
@@ -464,31 +756,29 @@ class Submit(View):
                 Expense.objects.create(
                     date=date, person=person, amount=amount,
                     created_by=person)
-                recompute_balances()
+                state.recompute = True
 
             return save
 
-        attendance_pattern = (r'^attendance (\d+)\s+(\d+)\s+([a-z0-9]+)\s+' +
-                              r'([a-z0-9]+)((?:\s+\d+)+)$')
-        mo = re.match(attendance_pattern, payload)
+        mo = ATTENDANCE_PATTERN.match(payload)
         if mo:
             year, month = map(int, mo.group(1, 2))
             creator_name, person_name = mo.group(3, 4)
             days = list(map(int, mo.group(5).split()))
 
-            def save():
-                try:
-                    person = Person.objects.get(username=person_name)
-                except Person.DoesNotExist:
+            def save(state):
+                person = state.get_person(person_name)
+                if person is None:
                     return '%r does not exist' % (person_name,)
-                try:
-                    created_by = Person.objects.get(username=creator_name)
-                except Person.DoesNotExist:
+                created_by = state.get_person(creator_name)
+                if created_by is None:
                     return '%r does not exist' % (creator_name,)
                 try:
                     dates = [datetime.date(year, month, d) for d in days]
                 except ValueError:
                     return 'Invalid date'
+                if state.is_closed(dates):
+                    return 'Month is closed'
                 existing = Attendance.objects.filter(
                     person=person, date__in=dates)
                 existing_dates = [e.date for e in existing]
@@ -496,12 +786,11 @@ class Submit(View):
                                      date=d)
                           for d in sorted(set(dates) - set(existing_dates))]
                 Attendance.objects.bulk_create(create)
-                recompute_balances()
+                state.recompute = True
 
             return save
 
-        token_pattern = r'^token (\d+)\s+(\d+)\s+(\d+)\s+([a-z0-9]+)$'
-        mo = re.match(token_pattern, payload)
+        mo = TOKEN_PATTERN.match(payload)
         if mo:
             year, month, day = map(int, mo.group(1, 2, 3))
             try:
@@ -512,18 +801,52 @@ class Submit(View):
                 return 'Wrong date'
             username = mo.group(4)
 
-            def save():
-                person = Person.get_or_create(username)
+            def save(state):
+                person = state.get_or_create_person(username)
                 token = AccessToken.get_or_create(person)
                 url = token.login_url()
                 assert url
-                return HttpResponse(json.dumps({'success': True,
-                                                'return': url}))
+                return {'return': url}
 
             return save
 
 
+class SubmitBatch(Submit):
+    '''
+    Like Submit, but takes any number of "payload" parameters.
+    All payloads are verified before any of them are saved,
+    and they are saved in one transaction with one recompute_balances().
+    '''
+    max_payloads = 1000
+
+    def post(self, request):
+        b64datas = request.POST.getlist('payload')
+        if not b64datas:
+            return HttpResponseBadRequest('Missing "payload" parameter')
+        if len(b64datas) > self.max_payloads:
+            return HttpResponseBadRequest(
+                'More than %s payloads' % self.max_payloads)
+        save_payloads = [self.verify_payload(b64data)
+                         for b64data in b64datas]
+        if any(isinstance(s, str) for s in save_payloads):
+            # Nothing is saved; report which payloads are invalid.
+            results = [{'error': s} if isinstance(s, str)
+                       else {'success': False}
+                       for s in save_payloads]
+            return HttpResponseBadRequest(json.dumps(
+                {'error': 'Invalid payload', 'results': results}))
+
+        state = SubmitState()
+        with transaction.atomic():
+            results = [self.result_dict(save_payload(state))
+                       for save_payload in save_payloads]
+            if state.recompute:
+                recompute_balances()
+        return HttpResponse(json.dumps({'success': True, 'results': results}))
+
+
 submit_view = csrf_exempt(Submit.as_view())
+submit_batch_view = csrf_exempt(SubmitBatch.as_view())
 
 
 @person_required
@@ -551,11 +874,10 @@ class ShoppingList(FormView):
 
 
 def publish(group_name, event, data):
-    msg = 'event:%s\ndata:%s\n\n' % (event, data)
-    Group(group_name).send({
-        "content": msg.encode(),
-        "more_content": True,
-    })
+    # Use the group name as version name, see get_missed_events().
+    old_version, version = bump_version(group_name)
+    content = format_event(event, data, id=version)
+    broadcast(group_name, content, old_version, version)
 
 
 def chat_publish(request):
@@ -572,12 +894,34 @@ def today_update(request):
     key = request.POST.get('key')
     if not key:
         return HttpResponseBadRequest('Missing POST "key"')
-    person = Person.get_or_create(request.user)
-    now = timezone.now()
-    if kind == 'rsvp_options':
-        Rsvp.set_rsvp(now.date(), person, key)
-    elif kind == 'announce':
-        Announce.create(now, person, key)
-    else:
-        return HttpResponseBadRequest('Invalid POST "kind"')
+    person = (Person.for_user(request.user) or
+              Person.get_or_create(request.user.username))
+    try:
+        lunchclub.today.apply_update(person, kind, key)
+    except ValueError as exn:
+        return HttpResponseBadRequest(str(exn))
     return HttpResponse('OK')
+
+
+def today_state(request):
+    '''
+    Return the state of today as JSON, like the "query" event,
+    for clients that can't keep an event stream open.
+
+    If ?date= is today and ?version= is the current version,
+    return 304 without querying RSVPs or announcements.
+    The response is immediate, since a long poll would hold one of the
+    few gunicorn workers; with ?wait=T, lunchclub.consumers.today_state
+    waits for a change on Daphne instead.
+    '''
+    if not request.user.is_authenticated():
+        return HttpResponseBadRequest('Not authenticated')
+    version = request.GET.get('version')
+    date = request.GET.get('date')
+    if (date == timezone.now().date().isoformat() and
+            version == str(get_version(lunchclub.today.VERSION))):
+        return HttpResponseNotModified()
+    response = HttpResponse(lunchclub.today.get_current_rsvp_json(),
+                            content_type='application/json')
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from roomcalendar.models import (
-    Calendar, CalendarItem,
+    Calendar, CalendarItem, CalendarSync,
 )
 
 
@@ -12,3 +12,8 @@ class PersonAdmin(admin.ModelAdmin):
 @admin.register(CalendarItem)
 class PersonAdmin(admin.ModelAdmin):
     list_display = ('subject', 'calendar', 'date', 'start_time', 'end_time')
+
+
+@admin.register(CalendarSync)
+class CalendarSyncAdmin(admin.ModelAdmin):
+    list_display = ('calendar', 'date', 'content_hash', 'updated_time')
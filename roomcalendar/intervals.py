@@ -0,0 +1,93 @@
+'''
+Index of the busy intervals of a calendar for free/busy queries.
+
+The intervals are kept sorted by start, and the union of the intervals
+(the busy time) is kept as two sorted lists, so both kinds of query
+start with a binary search instead of a scan over all items.
+'''
+import bisect
+import itertools
+
+
+class IntervalIndex:
+    '''
+    Half-open intervals [start, end) with a value, e.g. the start and end
+    times of the CalendarItems of one calendar.
+
+    >>> index = IntervalIndex([(9, 10, 'a'), (11, 13, 'b'), (12, 14, 'c')])
+    >>> index.overlapping(10, 12)
+    ['b']
+    >>> index.overlapping(12, 15)
+    ['b', 'c']
+    >>> index.busy(0, 24)
+    [(9, 10), (11, 14)]
+    >>> index.free(0, 24)
+    [(0, 9), (10, 11), (14, 24)]
+    >>> index.free(8, 12, min_length=2)
+    []
+    >>> index.is_free(10, 11)
+    True
+    '''
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda o: (o[0], o[1]))
+        self.starts = [start for start, end, value in intervals]
+        self.ends = [end for start, end, value in intervals]
+        self.values = [value for start, end, value in intervals]
+        # max_ends[i] is the latest end of the first i+1 intervals.
+        # It is non-decreasing, so it can be bisected to skip the
+        # intervals that end before a query starts.
+        self.max_ends = list(itertools.accumulate(self.ends, max))
+        # Union of the intervals: disjoint, so both lists are sorted.
+        self.busy_starts = []
+        self.busy_ends = []
+        for start, end in zip(self.starts, self.ends):
+            if self.busy_ends and start <= self.busy_ends[-1]:
+                self.busy_ends[-1] = max(self.busy_ends[-1], end)
+            else:
+                self.busy_starts.append(start)
+                self.busy_ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start, end):
+        '''
+        Return the values of the intervals overlapping [start, end),
+        ordered by start.
+
+        Takes O(log n + k) time for k results, plus the number of
+        intervals in the range that end early while an earlier,
+        longer interval is still running.
+        '''
+        lo = bisect.bisect_right(self.max_ends, start)
+        hi = bisect.bisect_left(self.starts, end)
+        return [self.values[i] for i in range(lo, hi)
+                if self.ends[i] > start]
+
+    def busy(self, start, end):
+        '''
+        Return the busy time within [start, end) as a list of disjoint
+        (start, end) pairs, in O(log n + k) time.
+        '''
+        lo = bisect.bisect_right(self.busy_ends, start)
+        hi = bisect.bisect_left(self.busy_starts, end)
+        return [(max(start, self.busy_starts[i]), min(end, self.busy_ends[i]))
+                for i in range(lo, hi)]
+
+    def free(self, start, end, min_length=None):
+        '''
+        Return the free time within [start, end) as a list of disjoint
+        (start, end) pairs at least min_length long, in O(log n + k) time.
+        '''
+        result = []
+        t = start
+        for busy_start, busy_end in self.busy(start, end) + [(end, end)]:
+            if t < busy_start and (min_length is None or
+                                   busy_start - t >= min_length):
+                result.append((t, busy_start))
+            t = busy_end
+        return result
+
+    def is_free(self, start, end):
+        i = bisect.bisect_right(self.busy_ends, start)
+        return i == len(self.busy_starts) or self.busy_starts[i] >= end
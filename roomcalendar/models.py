@@ -1,13 +1,22 @@
 import logging
+import itertools
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone, dateparse
 from django.core.exceptions import ValidationError
 
+from lunchclub.version import get_version, bump_version
+from roomcalendar.intervals import IntervalIndex
+
 
 logger = logging.getLogger('lunchclub')
 
+# Version of the calendars and their items.
+VERSION = 'roomcalendar'
+
 
 class Calendar(models.Model):
     name = models.CharField(max_length=200)
@@ -16,12 +25,6 @@ class Calendar(models.Model):
     def __str__(self):
         return self.name
 
-    def today_items(self):
-        today = timezone.now().date()
-        items = list(CalendarItem.existing_for_date(calendar=self, date=today))
-        items.sort(key=lambda o: o.start_time)
-        return items
-
     @classmethod
     def get_or_create(cls, name):
         try:
@@ -49,46 +52,179 @@ class CalendarItem(models.Model):
         )
 
     @classmethod
-    def existing_for_date(cls, calendar, date):
-        return list(cls.objects.filter(calendar=calendar, date=date))
-
-    @classmethod
-    def update_for_date(cls, calendar, items, date, created_by):
-        delete = []
-        existing = {}
-        for o in cls.existing_for_date(calendar, date):
-            ex = existing.setdefault((o.subject, o.start_time, o.end_time), o)
-            if o is not ex:
-                # Duplicate
-                delete.append(o)
-        current = {}
-        new = []
-        now = timezone.now()
+    def parse_items(cls, items):
+        '''
+        Return the (subject, start_time, end_time) keys of the items
+        in a CalendarUpdate payload, in order.
+        '''
+        keys = []
         for item in items:
+            if not isinstance(item, dict):
+                raise ValidationError('Expected an object for an item')
             try:
                 subject = item['subject']
                 start_str = item['start']
                 end_str = item['end']
             except KeyError as exn:
                 raise ValidationError('Missing key %s' % exn)
-            start = dateparse.parse_datetime(start_str)
+            if not all(isinstance(v, str)
+                       for v in (subject, start_str, end_str)):
+                raise ValidationError('Expected strings in item %r' % item)
+            try:
+                start = dateparse.parse_datetime(start_str)
+                end = dateparse.parse_datetime(end_str)
+            except ValueError as exn:
+                raise ValidationError(str(exn))
             if not start:
                 raise ValidationError(start_str)
-            end = dateparse.parse_datetime(end_str)
             if not end:
                 raise ValidationError(end_str)
-            o = cls(calendar=calendar,
-                    subject=subject, start_time=start, end_time=end,
-                    date=date, created_by=created_by, created_time=now)
-            o.clean()
-            k = (subject, start, end)
-            ex = current[k] = existing.setdefault(k, o)
-            if ex is o:
-                new.append(o)
-        delete.extend(existing[k] for k in existing.keys() - current.keys())
-        for o in delete:
-            logger.info('%s: Delete %r', created_by, o)
-            o.delete()
-        for o in new:
-            o.save()
-            logger.info('%s: Create %r', created_by, o)
+            keys.append((subject, start, end))
+        return keys
+
+    @classmethod
+    def update_for_date(cls, calendar, items, date, created_by):
+        '''
+        Make the items of the calendar on the date equal to the given items,
+        and return the number of rows deleted and created.
+
+        Existing items are read with one query; if nothing changed,
+        no other query is made.
+        '''
+        keys = cls.parse_items(items)
+        existing = {}
+        delete = []
+        rows = cls.objects.filter(calendar=calendar, date=date).values_list(
+            'pk', 'subject', 'start_time', 'end_time')
+        for pk, subject, start, end in rows:
+            if existing.setdefault((subject, start, end), pk) != pk:
+                # Duplicate
+                delete.append(pk)
+        current = set(keys)
+        delete.extend(pk for k, pk in existing.items() if k not in current)
+        now = timezone.now()
+        new = []
+        for k in keys:
+            if k not in existing:
+                # Mark as existing, so duplicates in items are created once.
+                existing[k] = None
+                subject, start, end = k
+                new.append(cls(calendar=calendar, subject=subject,
+                               start_time=start, end_time=end, date=date,
+                               created_by=created_by, created_time=now))
+        if not delete and not new:
+            return 0
+        with transaction.atomic():
+            if delete:
+                cls.objects.filter(pk__in=delete).delete()
+            cls.objects.bulk_create(new)
+            # bulk_create() and delete() on a queryset send no signals.
+            changed()
+        logger.info('%s: %s: Deleted %s, created %s on %s',
+                    created_by, calendar, len(delete), len(new), date)
+        return len(delete) + len(new)
+
+
+@receiver(post_save, sender=Calendar)
+@receiver(post_delete, sender=Calendar)
+@receiver(post_save, sender=CalendarItem)
+@receiver(post_delete, sender=CalendarItem)
+def calendar_changed(sender, instance, **kwargs):
+    changed()
+
+
+def changed():
+    # Bump after commit, so get_today_items() doesn't cache
+    # the old items under the new version.
+    transaction.on_commit(lambda: bump_version(VERSION))
+
+
+# The (date, version) of the last get_today_items() and its result
+_today_items_cache = (None, None)
+
+
+def get_today_items():
+    '''
+    Return a list of (calendar, items) for the calendars with items
+    today, ordered by calendar name and items by start time.
+    '''
+    global _today_items_cache
+
+    today = timezone.now().date()
+    # Get the version before the data, like lunchclub.today.
+    version = get_version(VERSION)
+    key, result = _today_items_cache
+    if key == (today, version):
+        return result
+
+    qs = CalendarItem.objects.filter(date=today).select_related('calendar')
+    qs = qs.order_by('calendar__name', 'calendar_id', 'start_time')
+    result = [(calendar, list(items)) for calendar, items in
+              itertools.groupby(qs, key=lambda o: o.calendar)]
+    _today_items_cache = ((today, version), result)
+    return result
+
+
+# The (date, version) of the last get_interval_indexes() and its result
+_interval_indexes_cache = (None, None)
+
+
+def get_interval_indexes():
+    '''
+    Return a dict mapping each calendar name to an IntervalIndex of
+    its items from today on, with the items as values.
+    The indexes are rebuilt when the calendars change.
+    '''
+    global _interval_indexes_cache
+
+    today = timezone.now().date()
+    version = get_version(VERSION)
+    key, result = _interval_indexes_cache
+    if key == (today, version):
+        return result
+
+    names = dict(Calendar.objects.values_list('id', 'name'))
+    intervals = {calendar_id: [] for calendar_id in names}
+    for o in CalendarItem.objects.filter(date__gte=today):
+        # Skip a calendar created after the first query.
+        if o.calendar_id in intervals:
+            intervals[o.calendar_id].append((o.start_time, o.end_time, o))
+    result = {names[calendar_id]: IntervalIndex(v)
+              for calendar_id, v in intervals.items()}
+    _interval_indexes_cache = ((today, version), result)
+    return result
+
+
+class CalendarSync(models.Model):
+    '''
+    The content hash sent by the sync client with the items of a calendar
+    on a date the last time they were applied, or "" if it sent none.
+    Dates without a row were never synced, so their items are unknown.
+    '''
+    calendar = models.ForeignKey(Calendar, on_delete=models.CASCADE)
+    date = models.DateField()
+    content_hash = models.CharField(max_length=64)
+    updated_time = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('calendar', 'date')
+
+    def __str__(self):
+        return '%s %s' % (self.calendar, self.date)
+
+    @classmethod
+    def get_hashes(cls, start, end):
+        '''
+        Return a dict mapping (calendar name, date) to the last applied
+        hash for the dates from start to end (inclusive).
+        '''
+        qs = cls.objects.filter(date__range=(start, end)).values_list(
+            'calendar__name', 'date', 'content_hash')
+        return {(name, date): h for name, date, h in qs}
+
+    @classmethod
+    def set_hash(cls, calendar, date, content_hash):
+        cls.objects.update_or_create(
+            calendar=calendar, date=date,
+            defaults=dict(content_hash=content_hash or '',
+                          updated_time=timezone.now()))
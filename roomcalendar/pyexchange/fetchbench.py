@@ -0,0 +1,100 @@
+'''
+Compare fetching the room calendars the old way (new ExchangeCalendar
+objects for each room in every round, one room at a time) with
+CalendarFetcher, against a fake EWS server that sleeps instead of
+making requests.
+'''
+import time
+import argparse
+import datetime
+import collections
+
+import pyexchange
+from pyexchange import ExchangeCalendar, CalendarFetcher
+
+
+Mailbox = collections.namedtuple('Mailbox', 'email_address')
+Item = collections.namedtuple('Item', 'subject start end')
+
+
+class FakeEWS:
+    '''
+    Stand-in for exchangelib.Account: the constructor takes as long as
+    autodiscover, and the protocol and calendar methods take as long as
+    the corresponding EWS requests.
+    '''
+    autodiscover_time = 1.0
+    resolve_time = 0.2
+    query_time = 0.3
+
+    def __init__(self, primary_smtp_address, credentials, autodiscover,
+                 access_type):
+        time.sleep(self.autodiscover_time)
+        self.primary_smtp_address = primary_smtp_address
+        self.protocol = self
+        self.calendar = self
+
+    def resolve_names(self, names):
+        time.sleep(self.resolve_time)
+        return [Mailbox('%s@example.com' % name) for name in names]
+
+    def filter(self, start__range):
+        time.sleep(self.query_time)
+        start, end = start__range
+        items = []
+        t = start + datetime.timedelta(hours=11)
+        while t < end:
+            items.append(Item(self.primary_smtp_address, t,
+                              t + datetime.timedelta(hours=1)))
+            t += datetime.timedelta(1)
+        return items
+
+
+def fetch_old(args, names, date, days):
+    result = {}
+    for name in names:
+        cal = ExchangeCalendar(calendar_name=name, **args)
+        result[name] = cal.items_for_dates(date, days)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rooms', type=int, default=2)
+    parser.add_argument('-i', '--iterations', type=int, default=5)
+    parser.add_argument('-n', '--days', type=int, default=7)
+    parser.add_argument('--autodiscover-time', type=float,
+                        default=FakeEWS.autodiscover_time)
+    parser.add_argument('--resolve-time', type=float,
+                        default=FakeEWS.resolve_time)
+    parser.add_argument('--query-time', type=float,
+                        default=FakeEWS.query_time)
+    args = parser.parse_args()
+    FakeEWS.autodiscover_time = args.autodiscover_time
+    FakeEWS.resolve_time = args.resolve_time
+    FakeEWS.query_time = args.query_time
+    pyexchange.Account = FakeEWS
+
+    ews_args = dict(email_address='user@example.com', username='user',
+                    password='hunter2')
+    names = ['room%s' % i for i in range(args.rooms)]
+    date = datetime.date.today()
+    fetcher = CalendarFetcher(calendar_names=names, **ews_args)
+    methods = [
+        ('Old', lambda: fetch_old(ews_args, names, date, args.days)),
+        ('CalendarFetcher',
+         lambda: fetcher.items_for_dates(date, args.days)),
+    ]
+    for label, fetch in methods:
+        times = []
+        for i in range(args.iterations):
+            t = time.perf_counter()
+            result = fetch()
+            times.append(time.perf_counter() - t)
+        assert sorted(result) == names
+        print('%s: first round %.2f s, later rounds %.2f s on average' %
+              (label, times[0], sum(times[1:]) / max(1, len(times) - 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
+import time
 import argparse
 import collections
 import datetime
 import subprocess
+import concurrent.futures
 
 from exchangelib import DELEGATE, Account, Credentials
 from exchangelib.ewsdatetime import EWSDateTime, EWSTimeZone
@@ -11,11 +13,15 @@ CalendarItem = collections.namedtuple('CalendarItem', 'subject start end')
 
 
 class ExchangeCalendar:
-    def __init__(self, email_address, username, password, calendar_name):
+    def __init__(self, email_address, username, password, calendar_name,
+                 ews_account=None):
         self.email_address = email_address
         self.username = username
         self.password = password
         self.calendar_name = calendar_name
+        if ews_account is not None:
+            # Share the account (and its connection pool) with other rooms.
+            self._cached_ews_account = ews_account
 
     @property
     def ews_credentials(self):
@@ -73,17 +79,30 @@ class ExchangeCalendar:
         return self._cached_ews_calendar
 
     def items_for_date(self, date):
+        return self.items_for_dates(date, 1)[date]
+
+    def items_for_dates(self, date, days):
+        '''
+        Fetch the items starting in the given number of days from date
+        with one EWS query and return a dict mapping each date to a list.
+        '''
         if not isinstance(date, datetime.date):
             raise TypeError(type(date).__name__)
         dt = EWSDateTime.from_datetime(
             datetime.datetime.combine(date, datetime.time()))
-        dt2 = dt + datetime.timedelta(1)
+        dt2 = dt + datetime.timedelta(days)
         tz = EWSTimeZone.timezone('Europe/Copenhagen')
         items = self.ews_calendar.filter(start__range=(
             tz.localize(dt),
             tz.localize(dt2)
         ))  # Filter by a date range
-        return (self.parse_calendar_item(item) for item in items)
+        result = {date + datetime.timedelta(i): [] for i in range(days)}
+        for item in items:
+            o = self.parse_calendar_item(item)
+            d = o.start.astimezone(tz).date()
+            if d in result:
+                result[d].append(o)
+        return result
 
     def parse_calendar_item(self, item):
         # CalendarItem(
@@ -184,6 +203,52 @@ class ExchangeCalendar:
         return CalendarItem(item.subject, item.start, item.end)
 
 
+class CalendarFetcher:
+    '''
+    Fetch the items of several room calendars concurrently.
+
+    The ExchangeCalendar objects, and with them the autodiscovered
+    accounts and resolved calendar addresses, are kept for ttl seconds
+    or until a fetch fails.
+    '''
+    def __init__(self, email_address, username, password, calendar_names,
+                 ttl=3600, max_workers=4):
+        self.args = dict(email_address=email_address, username=username,
+                         password=password)
+        self.calendar_names = list(calendar_names)
+        self.ttl = ttl
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.calendars = None
+        self.expiry = 0
+
+    def get_calendars(self):
+        now = time.monotonic()
+        if self.calendars is None or now >= self.expiry:
+            ews_account = ExchangeCalendar(
+                calendar_name=None, **self.args).ews_account
+            self.calendars = {
+                name: ExchangeCalendar(calendar_name=name,
+                                       ews_account=ews_account, **self.args)
+                for name in self.calendar_names}
+            self.expiry = now + self.ttl
+        return self.calendars
+
+    def items_for_dates(self, date, days):
+        '''
+        Return a dict mapping calendar names to the result of
+        ExchangeCalendar.items_for_dates().
+        '''
+        calendars = self.get_calendars()
+        futures = {name: self.executor.submit(cal.items_for_dates, date, days)
+                   for name, cal in calendars.items()}
+        try:
+            return {name: f.result() for name, f in futures.items()}
+        except Exception:
+            # Autodiscover and resolve the names again next time.
+            self.calendars = None
+            raise
+
+
 def parse_date(s):
     return datetime.datetime.strptime(s, '%Y-%m-%d').date()
 
@@ -195,6 +260,7 @@ parser.add_argument('-p', '--password', required=True)
 parser.add_argument('-c', '--calendar-name', required=True)
 parser.add_argument('-d', '--date', type=parse_date,
                     default=datetime.date.today())
+parser.add_argument('-n', '--days', type=int, default=7)
 
 
 def main():
@@ -205,9 +271,11 @@ def main():
             universal_newlines=True).splitlines()[0]
     args = vars(args)
     date = args.pop('date')
+    days = args.pop('days')
     cal = ExchangeCalendar(**args)
-    for i in cal.items_for_date(date):
-        print(i)
+    for d, items in sorted(cal.items_for_dates(date, days).items()):
+        for i in items:
+            print(d, i)
 
 
 if __name__ == '__main__':
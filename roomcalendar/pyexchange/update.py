@@ -1,10 +1,14 @@
 import os
 import json
 import time
+import hashlib
 import datetime
 import requests
 import subprocess
-from pyexchange import parser, ExchangeCalendar
+from pyexchange import parser, CalendarFetcher
+
+
+CALENDAR_NAMES = '5335-395 5335-327'.split()
 
 
 def to_dict(calendar_item):
@@ -13,15 +17,29 @@ def to_dict(calendar_item):
             'end': calendar_item.end.isoformat()}
 
 
-def update(args):
+def content_hash(items):
+    '''
+    Hash of the items of a calendar, which the server compares with the
+    hash it last applied to skip calendars that did not change.
+    '''
+    s = json.dumps(items, sort_keys=True)
+    return hashlib.sha256(s.encode('utf8')).hexdigest()
+
+
+def update(fetcher, days):
     date = datetime.date.today()
-    payload = {'date': date.strftime('%Y-%m-%d'),
-               'calendars': {}}
-    for c in '5335-395 5335-327'.split():
-        args['calendar_name'] = c
-        cal = ExchangeCalendar(**args)
-        data = list(cal.items_for_date(date))
-        payload['calendars'][c] = [to_dict(o) for o in data]
+    end = date + datetime.timedelta(days - 1)
+    payload = {'start_date': date.strftime('%Y-%m-%d'),
+               'end_date': end.strftime('%Y-%m-%d'),
+               'calendars': {},
+               'hashes': {}}
+    for c, calendar_days in fetcher.items_for_dates(date, days).items():
+        calendar_items = payload['calendars'][c] = {}
+        calendar_hashes = payload['hashes'][c] = {}
+        for d, data in calendar_days.items():
+            items = [to_dict(o) for o in data]
+            calendar_items[d.strftime('%Y-%m-%d')] = items
+            calendar_hashes[d.strftime('%Y-%m-%d')] = content_hash(items)
     payload_json = json.dumps(payload)
     url = os.environ.get('LUNCHCLUB_URL',
                          'https://apps.cs.au.dk/lunchclub')
@@ -32,11 +50,18 @@ def update(args):
     if response.status_code >= 300:
         print(response)
         raise Exception("HTTP %s" % response.status_code)
+    result = response.json()
+    for name, dates in sorted(result['applied'].items()):
+        print("Applied %s %s" % (name, ' '.join(dates)))
+    if result['applied']:
+        print("%s changes" % result['changed'])
 
 
 def main():
     args = vars(parser.parse_args())
     args.pop('date')
+    args.pop('calendar_name')
+    days = args.pop('days')
     if args['password'].startswith('env:'):
         args['password'] = os.environ[args['password'][4:]]
     elif args['password'].startswith('pass:'):
@@ -44,8 +69,9 @@ def main():
             ('pass', args['password'][5:]),
             universal_newlines=True).splitlines()[0]
 
+    fetcher = CalendarFetcher(calendar_names=CALENDAR_NAMES, **args)
     while True:
-        update(args)
+        update(fetcher, days)
         time.sleep(600)
 
 
@@ -1,16 +1,25 @@
 import json
 import datetime
 
+import pytz
+
 from django.views.generic import View
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponseBadRequest, JsonResponse
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone, dateparse
 
 from lunchclub.auth import TokenBackend
-from roomcalendar.models import Calendar, CalendarItem
+from roomcalendar.models import (
+    Calendar, CalendarItem, CalendarSync, get_interval_indexes,
+)
 
 
 class CalendarUpdate(View):
+    # Longest date range accepted in one push
+    max_days = 31
+
     @csrf_exempt
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
@@ -28,18 +37,211 @@ class CalendarUpdate(View):
         except ValueError as exn:
             return HttpResponseBadRequest(str(exn))
         try:
-            date_str = payload.pop('date')
-            calendars = payload.pop('calendars')
+            start, end, calendars, hashes = self.parse_payload(payload)
+        except ValidationError as exn:
+            return HttpResponseBadRequest(str(exn))
+        # Calendars whose hash equals the last applied hash are unchanged
+        # since the last push and are skipped.
+        applied_hashes = CalendarSync.get_hashes(start, end)
+        applied = {}
+        skipped = {}
+        changed = 0
+        try:
+            with transaction.atomic():
+                for name, days in sorted(calendars.items()):
+                    calendar = None
+                    for date, items in sorted(days.items()):
+                        date_str = date.strftime('%Y-%m-%d')
+                        content_hash = hashes.get(name, {}).get(date)
+                        if (content_hash and content_hash ==
+                                applied_hashes.get((name, date))):
+                            skipped.setdefault(name, []).append(date_str)
+                            continue
+                        if calendar is None:
+                            calendar = Calendar.get_or_create(name=name)
+                        changed += CalendarItem.update_for_date(
+                            calendar, items, date, user)
+                        CalendarSync.set_hash(calendar, date, content_hash)
+                        applied.setdefault(name, []).append(date_str)
+        except ValidationError as exn:
+            return HttpResponseBadRequest(str(exn))
+        return JsonResponse(dict(applied=applied, skipped=skipped,
+                                 changed=changed))
+
+    def parse_payload(self, payload):
+        '''
+        Return (start, end, calendars, hashes) where calendars[name][date]
+        is the list of items and hashes[name][date] the content hash
+        of a calendar on a date between start and end (inclusive).
+
+        The payload either has "start_date", "end_date" and "calendars"
+        and "hashes" keyed by calendar name and then by date, or a single
+        "date" and "calendars" and "hashes" keyed by calendar name.
+        A date in the range missing from a calendar means no items.
+        '''
+        check_dict(payload, 'payload')
+        try:
+            calendars = check_dict(payload['calendars'], '"calendars"')
+            hashes = check_dict(payload.get('hashes', {}), '"hashes"')
+            if 'date' in payload:
+                start = end = parse_date(payload['date'])
+                calendars = {name: {payload['date']: items}
+                             for name, items in calendars.items()}
+                hashes = {name: {payload['date']: h}
+                          for name, h in hashes.items()}
+            else:
+                start = parse_date(payload['start_date'])
+                end = parse_date(payload['end_date'])
         except KeyError as exn:
-            return HttpResponseBadRequest('Missing key %s' % exn)
+            raise ValidationError('Missing key %s' % exn)
+        if not start <= end < start + datetime.timedelta(self.max_days):
+            raise ValidationError('Invalid date range: %s to %s' %
+                                  (start, end))
+        dates = [start + datetime.timedelta(i)
+                 for i in range((end - start).days + 1)]
+        result = {}
+        for name, days in calendars.items():
+            days = check_dict(days, 'dates in %s' % name)
+            days = {parse_date(k): v for k, v in days.items()}
+            if not days.keys() <= set(dates):
+                raise ValidationError('Date outside range in %s' % name)
+            result[name] = {
+                date: check_list(days.get(date, []),
+                                 'items of %s on %s' % (name, date))
+                for date in dates}
+        hashes = {name: {parse_date(k): v for k, v in
+                         check_dict(days, 'hashes of %s' % name).items()}
+                  for name, days in hashes.items()}
+        for days in hashes.values():
+            if not all(v is None or isinstance(v, str) for v in days.values()):
+                raise ValidationError('Expected strings in "hashes"')
+        return start, end, result, hashes
+
+
+class CalendarFree(View):
+    '''
+    Free time and bookings of the rooms between the times "from" and "to"
+    (default the whole day) on "days" days (default 1) starting at "date"
+    (default today). With "min", only free slots of at least that many
+    minutes are returned. With "calendar" (repeatable), only those rooms.
+
+    Days that the sync client hasn't pushed (usually those more than a week
+    ahead) have "synced": false and "free": null, since their bookings
+    are unknown. "available" is false if a room has bookings, true if it
+    has none and all days are synced, and null otherwise.
+
+    For example, the rooms free for lunch this week:
+    calendar/free/?days=7&from=11:30&to=13:00
+    '''
+    max_days = 31
+
+    def get(self, request):
+        if not request.user.is_authenticated():
+            return HttpResponseBadRequest('Not authenticated')
+        today = timezone.localtime(timezone.now()).date()
         try:
-            date = datetime.datetime.strptime(date_str, '%Y-%m-%d')
-        except ValueError as exn:
-            return HttpResponseBadRequest('Invalid date: %r' % exn)
+            date = parse_date(request.GET.get('date') or str(today))
+            days = int(request.GET.get('days') or 1)
+            time_from = parse_time(request.GET.get('from') or '00:00')
+            time_to = parse_time(request.GET.get('to'))
+            min_minutes = float(request.GET.get('min') or 0)
+        except (ValueError, ValidationError) as exn:
+            return HttpResponseBadRequest(str(exn))
+        if date < today:
+            return HttpResponseBadRequest('Only today and later are indexed')
+        if not 1 <= days <= self.max_days:
+            return HttpResponseBadRequest('Invalid "days"')
+        # Also false for NaN. No free slot is longer than a day.
+        if not 0 <= min_minutes <= 24 * 60:
+            return HttpResponseBadRequest('Invalid "min"')
+        min_length = datetime.timedelta(minutes=min_minutes)
+        windows = []
         try:
-            for name, items in calendars.items():
-                CalendarItem.update_for_date(
-                    Calendar.get_or_create(name=name), items, date, user)
-        except ValidationError as exn:
+            for i in range(days):
+                d = date + datetime.timedelta(i)
+                start = make_aware(d, time_from)
+                if time_to is None:
+                    d_next = d + datetime.timedelta(1)
+                    end = make_aware(d_next, datetime.time())
+                else:
+                    end = make_aware(d, time_to)
+                if end <= start:
+                    return HttpResponseBadRequest('"to" must be after "from"')
+                windows.append((d, start, end))
+        except (OverflowError, ValidationError) as exn:
             return HttpResponseBadRequest(str(exn))
-        return HttpResponse('OK')
+
+        indexes = get_interval_indexes()
+        synced = CalendarSync.get_hashes(date, windows[-1][0])
+        names = request.GET.getlist('calendar') or sorted(indexes.keys())
+        calendars = []
+        for name in names:
+            try:
+                index = indexes[name]
+            except KeyError:
+                return HttpResponseBadRequest('No such calendar: %r' % name)
+            calendar_days = []
+            for d, start, end in windows:
+                items = index.overlapping(start, end)
+                free = None
+                if (name, d) in synced:
+                    free = [[format_time(s), format_time(e)]
+                            for s, e in index.free(start, end, min_length)]
+                calendar_days.append(dict(
+                    date=str(d), synced=free is not None, free=free,
+                    items=[dict(subject=o.subject,
+                                start=format_time(o.start_time),
+                                end=format_time(o.end_time))
+                           for o in items]))
+            if any(d['items'] for d in calendar_days):
+                available = False
+            elif all(d['synced'] for d in calendar_days):
+                available = True
+            else:
+                available = None
+            calendars.append(dict(
+                name=name, days=calendar_days, available=available))
+        return JsonResponse(dict(calendars=calendars))
+
+
+def check_dict(value, name):
+    if not isinstance(value, dict):
+        raise ValidationError('Expected an object for %s' % name)
+    return value
+
+
+def check_list(value, name):
+    if not isinstance(value, list):
+        raise ValidationError('Expected a list for %s' % name)
+    return value
+
+
+def make_aware(date, time):
+    '''
+    Return the date and time in the current time zone as an aware datetime.
+    Raise ValidationError if it doesn't exist or is ambiguous due to DST.
+    '''
+    try:
+        return timezone.make_aware(datetime.datetime.combine(date, time))
+    except (pytz.NonExistentTimeError, pytz.AmbiguousTimeError):
+        raise ValidationError('Invalid local time: %s %s' % (date, time))
+
+
+def format_time(t):
+    return timezone.localtime(t).isoformat()
+
+
+def parse_time(time_str):
+    if not time_str:
+        return None
+    t = dateparse.parse_time(time_str)
+    if t is None:
+        raise ValidationError('Invalid time: %r' % time_str)
+    return t
+
+
+def parse_date(date_str):
+    try:
+        return datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError) as exn:
+        raise ValidationError('Invalid date: %r' % exn)